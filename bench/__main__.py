@@ -0,0 +1,221 @@
+# bench/__main__.py
+"""
+Offline benchmarks of the hot paths against an in-process fake Telegram.
+
+    python -m bench                      # every scenario with the defaults
+    python -m bench stream seek --concurrency 32 --latency 0.1 --flood-wait-rate 0.01
+
+Run from the repository root. Reports throughput, p50/p99 time to first byte and memory per scenario.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import resource
+from types import SimpleNamespace
+
+SCENARIOS = ["stream", "seek", "posts", "thumbs", "app"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Offline benchmarks with a fake Telegram backend")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"any of {', '.join(SCENARIOS)}, all by default")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=2000, help="messages in the fake channel")
+    parser.add_argument("--file-size", type=int, default=16, help="size of every video in MB")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before every fake call answers")
+    parser.add_argument("--bandwidth", type=float, default=20, help="MB/s of a single fake GetFile")
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0, help="share of calls answered with a FloodWait")
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument("--no-chunk-cache", action="store_true", help="disable the disk chunk cache")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or SCENARIOS
+    return args
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_scenario(name, job, requests, concurrency):
+    """
+    Runs `job(i)` `requests` times, `concurrency` at once. A job returns (time to first byte, bytes).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfbs = []
+    sent = 0
+    errors = 0
+
+    async def one(i):
+        nonlocal sent, errors
+        async with semaphore:
+            try:
+                ttfb, size = await job(i)
+                ttfbs.append(ttfb)
+                sent += size
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"[{name}] request {i} failed: {e!r}", file=sys.stderr)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(requests / elapsed, 1),
+        "mb_per_s": round(sent / elapsed / 2 ** 20, 1),
+        "ttfb_p50_ms": round(percentile(ttfbs, 0.5) * 1000, 1),
+        "ttfb_p99_ms": round(percentile(ttfbs, 0.99) * 1000, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def consume(body, started):
+    ttfb = None
+    size = 0
+    async for chunk in body:
+        if ttfb is None:
+            ttfb = time.perf_counter() - started
+        size += len(chunk)
+    return (ttfb if ttfb is not None else time.perf_counter() - started), size
+
+
+async def main(args):
+    from bench.fake_telegram import FakeClient, FakeTelegram, install
+    import bot
+    import streamer
+
+    random.seed(args.seed)
+    backend = FakeTelegram(
+        messages=args.messages,
+        file_size=args.file_size * 2 ** 20,
+        latency=args.latency,
+        bandwidth=args.bandwidth * 2 ** 20,
+        flood_wait_rate=args.flood_wait_rate,
+        flood_wait_seconds=args.flood_wait_seconds,
+    )
+    install(backend)
+    # built like the clients of web.py, which leave every FloodWait to the scheduler
+    user = FakeClient(backend, "user", sleep_threshold=0)
+    bot_client = FakeClient(backend, "bot", sleep_threshold=0)
+    streamer.register_client(bot_client)
+    bot.DOWNLOADS_DIR = os.path.join(os.environ["BENCH_DIR"], "downloads")
+    channel = "@bench"
+    file_size = backend.file_size
+
+    async def stream(i):
+        request = SimpleNamespace(headers={}, method="GET")
+        started = time.perf_counter()
+        response = await streamer.media_streamer(bot_client, channel, i % backend.messages + 1, request)
+        return await consume(response.body_iterator, started)
+
+    async def seek(i):
+        start = random.randrange(file_size)
+        request = SimpleNamespace(headers={"Range": f"bytes={start}-{start + 2 ** 20 - 1}"}, method="GET")
+        started = time.perf_counter()
+        response = await streamer.media_streamer(bot_client, channel, random.randint(1, backend.messages), request)
+        return await consume(response.body_iterator, started)
+
+    pages = max(backend.messages // bot.PAGE_SIZE, 1)
+
+    async def posts(i):
+        started = time.perf_counter()
+        page = await bot.get_posts(user, channel, random.randint(1, pages))
+        return time.perf_counter() - started, len(page)
+
+    async def thumbs(i):
+        started = time.perf_counter()
+        path = await bot.get_image(bot_client, random.randint(1, backend.messages), channel)
+        return time.perf_counter() - started, os.path.getsize(path) if path else 0
+
+    app_job = None
+    if "app" in args.scenarios:
+        import httpx
+        import web
+
+        web.user = user
+        web.bot = bot_client
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=web.app), base_url="http://bench")
+
+        async def app_job(i):
+            kind = i % 3
+            if kind == 0:
+                url, headers = f"/api/v2/posts/bench?limit=50", {}
+            elif kind == 1:
+                url, headers = f"/api/thumb/bench/{random.randint(1, backend.messages)}", {}
+            else:
+                start = random.randrange(file_size)
+                url = f"/api/stream/bench/{random.randint(1, backend.messages)}"
+                headers = {"Range": f"bytes={start}-{start + 2 ** 20 - 1}"}
+            started = time.perf_counter()
+            async with http.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                return await consume(response.aiter_bytes(), started)
+
+    jobs = {"stream": stream, "seek": seek, "posts": posts, "thumbs": thumbs, "app": app_job}
+    results = []
+    for name in args.scenarios:
+        calls_before = dict(backend.calls)
+        result = await run_scenario(name, jobs[name], args.requests, args.concurrency)
+        result["telegram_calls"] = {
+            method: count - calls_before.get(method, 0)
+            for method, count in backend.calls.items()
+            if count != calls_before.get(method, 0)
+        }
+        results.append(result)
+        if not args.json:
+            print(
+                f"{name:8} {result['requests']:6} req {result['errors']:4} err {result['seconds']:8}s "
+                f"{result['req_per_s']:8} req/s {result['mb_per_s']:8} MB/s "
+                f"ttfb p50 {result['ttfb_p50_ms']:8}ms p99 {result['ttfb_p99_ms']:8}ms "
+                f"rss {result['rss_mb']}MB (peak {result['peak_rss_mb']}MB) calls {result['telegram_calls']}"
+            )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    await streamer.stop_streamers()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # every scenario runs on throwaway caches, set before the project modules read their config
+    bench_dir = tempfile.mkdtemp(prefix="techzindex-bench-")
+    os.environ["BENCH_DIR"] = bench_dir
+    os.environ["DATABASE_PATH"] = os.path.join(bench_dir, "index.db")
+    os.environ["CHUNK_CACHE_DIR"] = os.path.join(bench_dir, "chunks")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.no_chunk_cache:
+        os.environ["CHUNK_CACHE_SIZE"] = "0"
+    import logging
+    logging.basicConfig(level=os.environ["LOG_LEVEL"])
+    asyncio.run(main(args))
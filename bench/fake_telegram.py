@@ -0,0 +1,152 @@
+# bench/fake_telegram.py
+import os
+import zlib
+import random
+import asyncio
+from types import SimpleNamespace
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.file_id import FileId, FileType, FileUniqueId, FileUniqueType
+
+# every file is served from this block, repeated, so the fake needs no storage
+PATTERN = os.urandom(1024 * 1024)
+THUMB = b"\xff\xd8\xff\xe0" + os.urandom(16 * 1024)
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        messages: int = 2000,
+        file_size: int = 64 * 1024 * 1024,
+        latency: float = 0.05,
+        bandwidth: float = 20 * 1024 * 1024,
+        flood_wait_rate: float = 0.0,
+        flood_wait_seconds: int = 1,
+        dc_id: int = 4,
+    ):
+        """The server side shared by the fake clients, one channel of video posts.
+        attributes:
+            messages: how many messages the channel has, ids 1 to `messages`.
+            file_size: the size of every video.
+            latency: seconds every call takes before its first byte.
+            bandwidth: bytes per second of a single GetFile or download.
+            flood_wait_rate: the share of calls answered with a FloodWait of `flood_wait_seconds`.
+            calls: how many calls each method got.
+        """
+        self.messages = messages
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.dc_id = dc_id
+        self.calls = {}
+
+    async def call(self, method: str, size: int = 0, sleep_threshold: float = 0):
+        """
+        Waits as long as the call would take, may raise a FloodWait instead.
+        Like pyrogram, FloodWaits up to `sleep_threshold` seconds are slept through and the call retried.
+        """
+        self.calls[method] = self.calls.get(method, 0) + 1
+        while self.flood_wait_rate and random.random() < self.flood_wait_rate:
+            if self.flood_wait_seconds > sleep_threshold:
+                raise FloodWait(value=self.flood_wait_seconds)
+            await asyncio.sleep(self.flood_wait_seconds)
+        await asyncio.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+    def message(self, message_id: int):
+        if not 1 <= message_id <= self.messages:
+            return SimpleNamespace(id=message_id, empty=True, video=None, caption=None, media=None)
+        file_id = FileId(
+            file_type=FileType.VIDEO,
+            dc_id=self.dc_id,
+            media_id=message_id,
+            access_hash=message_id * 7919,
+            file_reference=b"bench",
+        ).encode()
+        unique_id = FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=message_id).encode()
+        thumb = SimpleNamespace(file_id=f"thumb-{message_id}", file_unique_id=f"{unique_id}-t")
+        video = SimpleNamespace(
+            file_id=file_id,
+            file_unique_id=unique_id,
+            file_size=self.file_size,
+            file_name=f"video {message_id}.mp4",
+            mime_type="video/mp4",
+            duration=600,
+            thumbs=[thumb],
+        )
+        return SimpleNamespace(id=message_id, empty=False, video=video, caption=None, media=True)
+
+    def read(self, offset: int, limit: int) -> bytes:
+        limit = max(min(limit, self.file_size - offset), 0)
+        start = offset % len(PATTERN)
+        data = PATTERN[start:start + limit]
+        while len(data) < limit:
+            data += PATTERN[: limit - len(data)]
+        return data
+
+
+class FakeSession:
+    def __init__(self, backend: FakeTelegram, dc_id: int):
+        """A media session answering upload.GetFile from the backend."""
+        self.backend = backend
+        self.dc_id = dc_id
+        self.is_started = asyncio.Event()
+        self.is_started.set()
+
+    async def invoke(self, query, retries: int = 10, timeout: float = 15, sleep_threshold: float = 10):
+        if isinstance(query, raw.functions.upload.GetFile):
+            data = self.backend.read(query.offset, query.limit)
+            await self.backend.call("GetFile", len(data), sleep_threshold)
+            return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0, bytes=data)
+        raise NotImplementedError(type(query).__name__)
+
+    async def send(self, query, *args, **kwargs):
+        return None
+
+    async def stop(self):
+        self.is_started.clear()
+
+
+class FakeClient:
+    def __init__(self, backend: FakeTelegram, name: str = "fake", sleep_threshold: float = 10):
+        """The part of pyrogram's Client this project uses, answered by the backend."""
+        self.backend = backend
+        self.name = name
+        self.sleep_threshold = sleep_threshold
+        self.me = SimpleNamespace(id=zlib.crc32(name.encode()))
+        self.is_connected = True
+
+    async def get_chat_history(self, chat_id, limit: int = 0, offset_id: int = 0):
+        top = min(offset_id - 1 if offset_id else self.backend.messages, self.backend.messages)
+        bottom = max(top - limit, 0) if limit else 0
+        # pyrogram fetches history in pages of 100 messages
+        for page_top in range(top, bottom, -100):
+            await self.backend.call("GetHistory", sleep_threshold=self.sleep_threshold)
+            for message_id in range(page_top, max(page_top - 100, bottom), -1):
+                yield self.backend.message(message_id)
+
+    async def get_messages(self, chat_id, message_ids):
+        await self.backend.call("GetMessages", sleep_threshold=self.sleep_threshold)
+        if isinstance(message_ids, (list, tuple)):
+            return [self.backend.message(message_id) for message_id in message_ids]
+        return self.backend.message(message_ids)
+
+    async def download_media(self, file_id, file_name: str = None, **kwargs):
+        await self.backend.call("DownloadMedia", len(THUMB), self.sleep_threshold)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, "wb") as f:
+            f.write(THUMB)
+        return file_name
+
+
+def install(backend: FakeTelegram):
+    """
+    Makes the media session pools open fake sessions instead of connecting to Telegram.
+    """
+    from utils.media_sessions import MediaSessionPool
+
+    async def create(pool, dc_id):
+        return FakeSession(backend, dc_id)
+
+    MediaSessionPool.create = create
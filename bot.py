@@ -2,163 +2,457 @@
 from pyrogram.client import Client
 from pyrogram.types import Message
 import os
-import json
+import time
+import shutil
+import hashlib
+import asyncio
 import logging
+import database
+from utils import LRUCache, Priority, telegram_scheduler
+from utils.metrics import cache_hits, cache_misses
+from utils.single_flight import SingleFlight
+from utils.file_properties import get_media_from_message
+from streamer import clear_file_ids
+from config import PAGE_TTL
 
 logger = logging.getLogger(__name__)
 
 # --- Cache Management Functions ---
 
-def rm_cache(channel=None):
-    logger.info("Cleaning Cache...")
-    global image_cache
-    image_cache = {}
+def rm_cache(channel=None, keep_posts=False):
+    """
+    Clears the caches of one channel, or of every channel when none is given.
+    Only the entries of that channel are touched: its posts, thumbnails and file ids.
+    `keep_posts` leaves the indexed posts in place, for a refresh that replaces them later.
+    """
+    logger.info(f"Cleaning Cache of {channel or 'all channels'}...")
+    if channel is not None:
+        channel = get_chat_identifier(str(channel))
 
-    downloads_path = "downloads"
+    image_cache.clear(channel)
+    thumb_bytes_cache.clear(channel)
+    clear_file_ids(channel)
+
+    downloads_path = os.path.join(DOWNLOADS_DIR, str(channel)) if channel is not None else DOWNLOADS_DIR
     if os.path.exists(downloads_path):
-        for file_name in os.listdir(downloads_path):
-            file_path = os.path.join(downloads_path, file_name)
-            try:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Removed download: {file_path}")
-            except Exception as e:
-                logger.error(f"Error removing download {file_path}: {e}")
+        try:
+            shutil.rmtree(downloads_path)
+            logger.info(f"Removed downloads: {downloads_path}")
+        except Exception as e:
+            logger.error(f"Error removing downloads {downloads_path}: {e}")
     else:
         logger.warning(f"Downloads directory not found: {downloads_path}")
 
-    cache_path = "cache"
-    if os.path.exists(cache_path):
-        for file_name in os.listdir(cache_path):
-            file_path = os.path.join(cache_path, file_name)
-            try:
-                if file_name.endswith(".json"):
-                    if channel:
-                        if file_name.startswith(channel):
-                            os.remove(file_path)
-                            logger.info(f"Removed cache file: {file_path}")
-                    else:
-                        os.remove(file_path)
-                        logger.info(f"Removed cache file: {file_path}")
-            except Exception as e:
-                logger.error(f"Error removing cache file {file_path}: {e}")
+    if keep_posts:
+        return
+    if channel is not None:
+        database.delete_channel(channel)
     else:
-        logger.warning(f"Cache directory not found: {cache_path}")
+        database.delete_all()
 
 
-def get_cache(channel, page):
-    cache_file_path = f"cache/{channel}-{page}.json"
-    if os.path.exists(cache_file_path):
-        try:
-            with open(cache_file_path, "r") as f:
-                logger.info(f"Loading cache from {cache_file_path}")
-                return json.load(f)["posts"]
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Error reading cache file {cache_file_path}: {e}")
-            return None
+# --- Pyrogram Interaction Functions ---
+
+PAGE_SIZE = 50
+HISTORY_BATCH = 100
+MAX_HISTORY_BATCHES = 10
+SYNC_INTERVAL = PAGE_TTL
+
+channel_locks = {}
+sync_tasks = {}
+
+
+def get_chat_identifier(channel: str):
+    if channel.lstrip('-').isdigit():
+        return int(channel)
+    return "@" + channel.lstrip('@').lower()
+
+
+def get_channel_lock(channel):
+    """Serializes history fetches of a channel between requests and the crawler."""
+    return channel_locks.setdefault(str(channel), asyncio.Lock())
+
+
+def new_channel_state():
+    return {"oldest_id": None, "newest_id": None, "complete": False, "synced_at": 0}
+
+
+def load_channel_state(channel):
+    """
+    Returns how far a channel is indexed, a new state when it was found empty and is due another look.
+    """
+    state = database.get_channel_state(channel)
+    if state is None or (state["newest_id"] is None and time.time() - state["synced_at"] > SYNC_INTERVAL):
+        return new_channel_state()
+    return state
+
+
+def parse_post(post: Message):
+    """
+    Extracts the post record from a message, None if the message isn't indexed.
+    """
+    if post.video and post.video.thumbs:
+        file_name = post.video.file_name or post.caption or post.video.file_id
+        title = " ".join(str(file_name).split(".")[:-1]) if isinstance(file_name, str) else str(file_name)
+        title = title[:200].strip()
+    elif post.caption and post.media:
+        title = post.caption[:200].strip()
     else:
         return None
 
+    media = get_media_from_message(post)
+    thumbs = getattr(media, "thumbs", None)
+    return {
+        "msg-id": post.id,
+        "title": title,
+        "size": getattr(media, "file_size", None),
+        "mime": getattr(media, "mime_type", None),
+        "duration": getattr(media, "duration", None),
+        # file unique ids are the same for every account, the bot's thumbnail shares it
+        "thumb": thumbs[0].file_unique_id if thumbs else None,
+    }
 
-def save_cache(channel, cache, page):
-    cache_dir = "cache"
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
 
-    cache_file_path = f"{cache_dir}/{channel}-{page}.json"
-    try:
-        with open(cache_file_path, "w") as f:
-            json.dump(cache, f)
-            logger.info(f"Saved cache to {cache_file_path}")
-    except Exception as e:
-        logger.error(f"Error saving cache to {cache_file_path}: {e}")
+async def fetch_older_posts(client: Client, channel, state):
+    """
+    Indexes the next batch of history below the oldest message seen so far.
+    Returns the updated channel state.
+    """
+    offset_id = state["oldest_id"] or 0
+    logger.info(f"Calling client.get_chat_history for channel: {channel}, limit: {HISTORY_BATCH}, offset_id: {offset_id}")
+    posts = []
+    oldest_id = state["oldest_id"]
+    top_id = state["newest_id"] or 0
+    seen = 0
+    async for post in client.get_chat_history(
+        chat_id=channel, limit=HISTORY_BATCH, offset_id=offset_id
+    ):
+        post: Message
+        seen += 1
+        oldest_id = post.id if oldest_id is None else min(oldest_id, post.id)
+        top_id = max(top_id, post.id)
+        record = parse_post(post)
+        if record:
+            posts.append(record)
 
+    database.save_posts(channel, posts)
+    state = dict(state, oldest_id=oldest_id, complete=seen < HISTORY_BATCH)
+    if offset_id == 0:
+        # the first batch starts at the newest message of the channel
+        state["newest_id"] = top_id or None
+        # an empty channel is stored as complete, it is looked at again once its sync is stale
+        state["synced_at"] = time.time()
+    database.set_channel_state(channel, state)
+    logger.info(f"Indexed {len(posts)} posts from {seen} messages for channel {channel}.")
+    return state
 
-# --- Pyrogram Interaction Functions ---
 
-async def get_posts(client: Client, channel: str, page: int = 1):
+async def fetch_newer_posts(client: Client, channel, state):
     """
-    Fetches posts from a Telegram channel using the provided Pyrogram client.
-    Caches the results.
+    Indexes only the messages newer than the newest one already indexed.
+    Returns the updated channel state.
+    """
+    newest_id = state["newest_id"]
+    logger.info(f"Syncing channel {channel} above message {newest_id}")
+    posts = []
+    top_id = newest_id
+    async for post in client.get_chat_history(chat_id=channel):
+        post: Message
+        if post.id <= newest_id:
+            break
+        top_id = max(top_id, post.id)
+        record = parse_post(post)
+        if record:
+            posts.append(record)
+
+    database.save_posts(channel, posts)
+    state = dict(state, newest_id=top_id, synced_at=time.time())
+    database.set_channel_state(channel, state)
+    logger.info(f"Indexed {len(posts)} new posts for channel {channel}.")
+    return state
+
+
+def index_message(channel, post: Message):
+    """
+    Adds a message received from the bot's channel updates to an already indexed channel.
+    """
+    state = database.get_channel_state(channel)
+    if state is None:
+        return
+    record = parse_post(post)
+    if record:
+        database.save_posts(channel, [record])
+    # channel message ids are sequential, only move the sync cursor when nothing was missed
+    if state["newest_id"] is not None and post.id == state["newest_id"] + 1:
+        database.set_channel_state(channel, dict(state, newest_id=post.id))
+
+
+async def iter_posts(client: Client, channel: str, page: int = 1, before_id=None, limit: int = PAGE_SIZE):
+    """
+    Yields a page of posts from a Telegram channel out of the post database.
+    Pages are given either by number or, for cursor pagination, by the message id they start below.
+    History is fetched from Telegram only when the database doesn't cover the page yet,
+    posts already indexed are yielded before the next batch is fetched.
+    While the client isn't connected only the indexed posts are served.
     """
     page = int(page)
-    cache = get_cache(channel, page)
-    if cache:
-        logger.info(f"Returning posts from cache for channel {channel}, page {page}")
-        return cache
+    lock = get_channel_lock(channel)
+    sent = 0
+    last_id = before_id
+    batches = 0
+    online = client is not None and client.is_connected
+
+    if online and page == 1 and before_id is None:
+        # stale-while-revalidate: the indexed posts are served now, newer ones are synced for the next request
+        state = database.get_channel_state(channel)
+        if state and state["newest_id"] is not None and time.time() - state["synced_at"] > SYNC_INTERVAL:
+            schedule_sync(client, channel)
+
+    while True:
+        state = load_channel_state(channel)
+        # keyset: the first load finds where the page starts, the next ones continue below the last post sent
+        anchor = database.page_anchor(channel, page, limit) if last_id is None else last_id
+        for post in database.load_posts(channel, anchor, limit - sent):
+            sent += 1
+            last_id = post["msg-id"]
+            yield post
+        if sent >= limit or state["complete"] or batches >= MAX_HISTORY_BATCHES or not online:
+            break
+
+        async with lock:
+            # another request may have indexed more history while we waited for the lock
+            if load_channel_state(channel) == state:
+                try:
+                    await telegram_scheduler.run(client, Priority.HISTORY, fetch_older_posts, client, channel, state)
+                except Exception as e:
+                    logger.error(f"Error getting chat history for channel {channel}: {e}", exc_info=True) # exc_info=True prints traceback
+                    break
+        batches += 1
+
+    # a page is a hit when the database already covered it
+    if batches:
+        cache_misses.inc(cache="posts")
     else:
-        logger.info(f"Fetching posts from Telegram for channel {channel} (ID/Username: {channel}), page {page}")
-        posts = []
-        try:
-            # Attempt to fetch history
-            logger.info(f"Calling client.get_chat_history for channel: {channel}, limit: 50, offset: {(page - 1) * 50}")
-            async for post in client.get_chat_history(
-                chat_id=channel, limit=50, offset=(page - 1) * 50
-            ):
-                post: Message
-                if post.video and post.video.thumbs:
-                    file_name = post.video.file_name or post.caption or post.video.file_id
-                    title = " ".join(str(file_name).split(".")[:-1]) if isinstance(file_name, str) else str(file_name)
-                    title = title[:200].strip()
-                    posts.append({"msg-id": post.id, "title": title})
-                elif post.caption and post.media:
-                    title = post.caption[:200].strip()
-                    posts.append({"msg-id": post.id, "title": title})
-            
-            logger.info(f"Successfully fetched {len(posts)} posts for channel {channel}.")
+        cache_hits.inc(cache="posts")
+    logger.debug(f"Returned {sent} posts for channel {channel}, page {page}")
+
 
+async def sync_newer_posts(client: Client, channel):
+    async with get_channel_lock(channel):
+        # the state is read again, a previous sync may have finished while we waited for the lock
+        state = database.get_channel_state(channel)
+        if not state or state["newest_id"] is None or time.time() - state["synced_at"] <= SYNC_INTERVAL:
+            return
+        try:
+            await telegram_scheduler.run(client, Priority.HISTORY, fetch_newer_posts, client, channel, state)
         except Exception as e:
-            logger.error(f"Error getting chat history for channel {channel}: {e}", exc_info=True) # exc_info=True prints traceback
-            # If there's an error fetching, return empty list or raise
-            return []
+            # the posts already indexed stay as they are, the next stale request tries again
+            logger.error(f"Error syncing new posts for channel {channel}: {e}", exc_info=True)
 
-        save_cache(channel, {"posts": posts}, page)
-        return posts
 
+def schedule_sync(client: Client, channel):
+    """
+    Starts syncing a channel's newer posts in the background, once per channel at a time.
+    """
+    if channel in sync_tasks:
+        return
+    task = asyncio.create_task(sync_newer_posts(client, channel))
+    sync_tasks[channel] = task
+    task.add_done_callback(lambda _: sync_tasks.pop(channel, None))
 
-image_cache = {}
+
+async def get_posts(client: Client, channel: str, page: int = 1):
+    """
+    Returns a page of posts from a Telegram channel, see iter_posts.
+    """
+    return [post async for post in iter_posts(client, channel, page)]
+
+
+# thumbnail paths keyed by (channel, message_id)
+image_cache = LRUCache(maxsize=4096, ttl=6 * 60 * 60)
+image_flights = SingleFlight()
+# hot thumbnails as (bytes, etag) keyed by (channel, message_id)
+thumb_bytes_cache = LRUCache(maxsize=512, ttl=6 * 60 * 60)
+
+DOWNLOADS_DIR = os.path.abspath("downloads")
+THUMB_WORKERS = 4
+thumb_semaphore = asyncio.Semaphore(THUMB_WORKERS)
+thumb_tasks = set()
+
+
+def thumb_path(channel, file_id_or_message_id):
+    # one directory per channel, so a channel's thumbnails are removed on their own
+    return os.path.join(DOWNLOADS_DIR, str(channel), str(file_id_or_message_id))
+
+
+async def download_thumb(bot_client: Client, channel, file_id_or_message_id, thumb_file_id):
+    """
+    Downloads a thumbnail through the worker pool and caches its path.
+    """
+    async with thumb_semaphore:
+        os.makedirs(os.path.join(DOWNLOADS_DIR, str(channel)), exist_ok=True) # Ensure downloads directory exists
+        download_path = await telegram_scheduler.run(
+            bot_client,
+            Priority.THUMB,
+            bot_client.download_media,
+            str(thumb_file_id),
+            file_name=thumb_path(channel, file_id_or_message_id),
+        )
+    if download_path:
+        image_cache.set((channel, file_id_or_message_id), download_path)
+    return download_path
+
+
+async def fetch_image(bot_client: Client, file_id_or_message_id, channel):
+    cache_key = f"{channel}-{file_id_or_message_id}"
+    logger.info(f"Downloading image from Telegram: {cache_key}")
+    try:
+        if not isinstance(file_id_or_message_id, int):
+            return await download_thumb(bot_client, channel, file_id_or_message_id, file_id_or_message_id)
+
+        thumb = database.get_thumb(channel, file_id_or_message_id)
+        if thumb and thumb["file_id"] == database.NO_THUMB:
+            return None
+        if thumb:
+            try:
+                return await download_thumb(bot_client, channel, file_id_or_message_id, thumb["file_id"])
+            except Exception as e:
+                logger.warning(f"Stored thumbnail of {cache_key} failed, refetching message: {e}")
+
+        msg = await telegram_scheduler.run(bot_client, Priority.THUMB, bot_client.get_messages, channel, file_id_or_message_id)
+        if msg and msg.video and msg.video.thumbs:
+            database.save_thumbs(channel, [thumb_record(msg)])
+            return await download_thumb(bot_client, channel, file_id_or_message_id, msg.video.thumbs[0].file_id)
+        if msg:
+            database.save_thumbs(channel, [no_thumb_record(file_id_or_message_id)])
+        logger.warning(f"No video or thumbnail found for message ID {file_id_or_message_id} in {channel}")
+        return None
+
+    except Exception as e:
+        logger.error(f"Error downloading image {cache_key}: {e}", exc_info=True)
+        return None
 
 
 async def get_image(bot_client: Client, file_id_or_message_id: int, channel: str):
     """
     Downloads and caches a video thumbnail from a Telegram message.
     'file_id_or_message_id' can be a message ID or a file ID.
+    Thumbnails already on disk are served without calling Telegram.
     """
-    global image_cache
-
     cache_key = f"{channel}-{file_id_or_message_id}"
-    cache = image_cache.get(cache_key)
-    if cache:
-        logger.info(f"Returning image from in-memory cache: {cache_key}")
+    cache = image_cache.get((channel, file_id_or_message_id))
+    if cache and os.path.exists(cache):
+        logger.debug(f"Returning image from in-memory cache: {cache_key}")
+        cache_hits.inc(cache="thumbs")
         return cache
-    else:
-        logger.info(f"Downloading image from Telegram: {cache_key}")
-        download_path = None
-        downloads_dir = "downloads"
-        os.makedirs(downloads_dir, exist_ok=True) # Ensure downloads directory exists
 
-        try:
-            if isinstance(file_id_or_message_id, int):
-                msg = await bot_client.get_messages(channel, file_id_or_message_id)
-                if msg and msg.video and msg.video.thumbs:
-                    download_path = await bot_client.download_media(
-                        str(msg.video.thumbs[0].file_id),
-                        file_name=os.path.join(downloads_dir, cache_key)
-                    )
-                else:
-                    logger.warning(f"No video or thumbnail found for message ID {file_id_or_message_id} in {channel}")
-            else:
-                download_path = await bot_client.download_media(
-                    str(file_id_or_message_id),
-                    file_name=os.path.join(downloads_dir, cache_key)
-                )
-
-            if download_path:
-                image_cache[cache_key] = download_path
-                return download_path
-            else:
-                return None
+    path = thumb_path(channel, file_id_or_message_id)
+    if os.path.exists(path):
+        image_cache.set((channel, file_id_or_message_id), path)
+        cache_hits.inc(cache="thumbs")
+        return path
+
+    cache_misses.inc(cache="thumbs")
+    return await image_flights.do(
+        (channel, file_id_or_message_id), fetch_image, bot_client, file_id_or_message_id, channel
+    )
+
+
+def thumb_etag(channel, message_id, data: bytes):
+    """
+    Strong ETag from the thumbnail's unique id, falls back to a hash of the bytes.
+    """
+    thumb = database.get_thumb(channel, message_id) if isinstance(message_id, int) else None
+    if thumb and thumb["unique_id"]:
+        return f'"{thumb["unique_id"]}"'
+    return f'"{hashlib.sha1(data).hexdigest()}"'
+
+
+def has_cached_thumb(channel, message_id) -> bool:
+    """Whether a thumbnail can be served without Telegram, from memory or disk."""
+    return (channel, message_id) in thumb_bytes_cache or os.path.exists(thumb_path(channel, message_id))
+
+
+def get_cached_thumb(channel, message_id):
+    thumb = thumb_bytes_cache.get((channel, message_id))
+    if thumb:
+        # misses are counted by get_image, which knows whether the disk had it
+        cache_hits.inc(cache="thumbs")
+    return thumb
+
+
+async def get_thumb_bytes(bot_client: Client, message_id: int, channel):
+    """
+    Returns a thumbnail as (bytes, etag), hot thumbnails are kept in memory.
+    """
+    thumb = get_cached_thumb(channel, message_id)
+    if thumb:
+        return thumb
+    img_path = await get_image(bot_client, message_id, channel)
+    if not img_path or not os.path.exists(img_path):
+        return None
+    with open(img_path, "rb") as f:
+        data = f.read()
+    thumb = (data, thumb_etag(channel, message_id, data))
+    thumb_bytes_cache.set((channel, message_id), thumb)
+    return thumb
+
+
+def thumb_record(msg: Message):
+    thumb = msg.video.thumbs[0]
+    return {"msg-id": msg.id, "file_id": thumb.file_id, "unique_id": thumb.file_unique_id}
+
+
+def no_thumb_record(message_id: int):
+    return {"msg-id": message_id, "file_id": database.NO_THUMB, "unique_id": None}
+
 
+async def prefetch_thumbs(bot_client: Client, channel, posts):
+    """
+    Downloads the missing thumbnails of a page. Only the posts whose thumbnail isn't stored yet
+    are fetched, in one batched call, posts known to have none are skipped.
+    """
+    stored = database.get_thumbs(channel, [post["msg-id"] for post in posts])
+    missing = [
+        post["msg-id"] for post in posts
+        if stored.get(post["msg-id"]) != database.NO_THUMB
+        and (channel, post["msg-id"]) not in image_cache
+        and not os.path.exists(thumb_path(channel, post["msg-id"]))
+    ]
+    if not missing:
+        return
+    records = [{"msg-id": msg_id, "file_id": stored[msg_id]} for msg_id in missing if stored.get(msg_id)]
+    unknown = [msg_id for msg_id in missing if msg_id not in stored]
+    if unknown:
+        try:
+            messages = await telegram_scheduler.run(bot_client, Priority.THUMB, bot_client.get_messages, channel, unknown)
         except Exception as e:
-            logger.error(f"Error downloading image {cache_key}: {e}", exc_info=True)
-            return None
+            logger.error(f"Error prefetching thumbnails for channel {channel}: {e}", exc_info=True)
+            messages = []
+        fetched = [
+            thumb_record(msg) if msg.video and msg.video.thumbs else no_thumb_record(message_id)
+            for message_id, msg in zip(unknown, messages)
+            if msg
+        ]
+        database.save_thumbs(channel, fetched)
+        records += [record for record in fetched if record["file_id"]]
+    if not records:
+        return
+    logger.debug(f"Prefetching {len(records)} thumbnails for channel {channel}")
+    await asyncio.gather(
+        *[
+            image_flights.do(
+                (channel, record["msg-id"]), download_thumb, bot_client, channel, record["msg-id"], record["file_id"]
+            )
+            for record in records
+        ],
+        return_exceptions=True,
+    )
+
+
+def schedule_thumb_prefetch(bot_client: Client, channel, posts):
+    if not bot_client or not bot_client.is_connected or not posts:
+        return
+    task = asyncio.create_task(prefetch_thumbs(bot_client, channel, posts))
+    thumb_tasks.add(task)
+    task.add_done_callback(thumb_tasks.discard)
@@ -16,3 +16,46 @@ HOME_PAGE_REDIRECT = os.getenv("HOME_PAGE_REDIRECT", "https://example.com/defaul
 BASE_URL = os.getenv("BASE_URL", "https://your-koyeb-app-domain.koyeb.app")
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 ADMINS = list(map(int, os.getenv("ADMINS", f"{OWNER_ID}").split(',')))
+
+# --- Streaming Configuration ---
+# Number of GetFile requests kept in flight per stream
+STREAM_PREFETCH = int(os.getenv("STREAM_PREFETCH", "4"))
+# Extra bot tokens used only for streaming, comma separated (each bot must be admin in the channels)
+MULTI_BOT_TOKENS = [token.strip() for token in os.getenv("MULTI_BOT_TOKENS", "").split(",") if token.strip()]
+# Media sessions kept per DC and the DCs connected at startup
+MEDIA_SESSIONS_PER_DC = int(os.getenv("MEDIA_SESSIONS_PER_DC", "2"))
+WARM_DCS = [int(dc) for dc in os.getenv("WARM_DCS", "1,2,3,4,5").split(",") if dc.strip()]
+# Telegram calls allowed per second and burst size, per client
+TG_RATE = float(os.getenv("TG_RATE", "30"))
+TG_BURST = int(os.getenv("TG_BURST", "60"))
+# File parts per second per media DC of a client, 0 leaves them unlimited apart from FloodWaits
+TG_MEDIA_RATE = float(os.getenv("TG_MEDIA_RATE", "0"))
+# Disk cache for streamed parts, size in MB (0 disables it)
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", "chunks")
+CHUNK_CACHE_SIZE = int(os.getenv("CHUNK_CACHE_SIZE", "512")) * 1024 * 1024
+
+# --- Crawler Configuration ---
+# Channels indexed in the background ahead of visitors, comma separated usernames or ids
+CRAWL_CHANNELS = [channel.strip() for channel in os.getenv("CRAWL_CHANNELS", "").split(",") if channel.strip()]
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", "2"))
+# Seconds between two history batches of a worker and between two passes over the channels
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", "5"))
+CRAWL_REFRESH_INTERVAL = int(os.getenv("CRAWL_REFRESH_INTERVAL", "3600"))
+
+# --- Cache Configuration ---
+# SQLite database holding the indexed channel posts
+DATABASE_PATH = os.getenv("DATABASE_PATH", "cache/index.db")
+# Seconds a channel's posts are fresh, older pages are served while newer posts are synced in the background
+PAGE_TTL = int(os.getenv("PAGE_TTL", "60"))
+
+# --- Deployment Configuration ---
+# HTTP worker processes, above 1 a gateway process owns the Telegram clients and the workers reach it over GATEWAY_SOCKET
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "1"))
+GATEWAY_SOCKET = os.getenv("GATEWAY_SOCKET", "/tmp/techzindex-gateway.sock")
+# Set by start.sh: "gateway", "worker", or empty when a single process does everything
+ROLE = os.getenv("ROLE", "")
+
+# --- Logging Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Share of the DEBUG per request log lines that are written
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
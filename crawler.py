@@ -0,0 +1,112 @@
+# crawler.py
+import time
+import asyncio
+import logging
+import database
+from bot import (
+    HISTORY_BATCH,
+    fetch_newer_posts,
+    fetch_older_posts,
+    get_channel_lock,
+    load_channel_state,
+    prefetch_thumbs,
+)
+from utils import Priority, telegram_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Crawler:
+    def __init__(self, workers: int = 2, delay: float = 5, refresh_interval: int = 60 * 60):
+        """Walks whole channels in the background to fill the post database and thumbnails.
+        attributes:
+            workers: how many channels are crawled at the same time.
+            delay: seconds a worker waits between two history batches.
+            refresh_interval: seconds between two passes over the configured channels.
+
+        Progress lives in the channels table, so a crawl resumes where it stopped after a restart.
+        """
+        self.workers = workers
+        self.delay = delay
+        self.refresh_interval = refresh_interval
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.queued = set()
+        self.refreshes = {}
+        self.tasks = []
+        self.user = None
+        self.bot = None
+
+    def start(self, user, bot, channels):
+        self.user = user
+        self.bot = bot
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if channels:
+            self.tasks.append(asyncio.create_task(self.refresh(channels)))
+        logger.info(f"Crawler started with {self.workers} workers for {len(channels)} channels")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def enqueue(self, channel, recrawl=False):
+        """
+        Queues a channel, `recrawl` walks its whole history again instead of resuming.
+        """
+        if recrawl:
+            database.reset_channel_progress(channel)
+            # the old posts keep being served until the new crawl is done
+            self.refreshes.setdefault(channel, time.time())
+        if channel not in self.queued:
+            self.queued.add(channel)
+            self.queue.put_nowait(channel)
+
+    async def refresh(self, channels):
+        while True:
+            for channel in channels:
+                self.enqueue(channel)
+            await asyncio.sleep(self.refresh_interval)
+
+    async def worker(self):
+        while True:
+            channel = await self.queue.get()
+            try:
+                await self.crawl(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error crawling channel {channel}: {e}", exc_info=True)
+            finally:
+                self.queued.discard(channel)
+                self.queue.task_done()
+
+    async def crawl(self, channel):
+        logger.info(f"Crawling channel {channel}")
+        lock = get_channel_lock(channel)
+
+        state = database.get_channel_state(channel)
+        if state and state["newest_id"] is not None:
+            async with lock:
+                state = await telegram_scheduler.run(self.user, Priority.HISTORY, fetch_newer_posts, self.user, channel, state)
+
+        while True:
+            async with lock:
+                state = load_channel_state(channel)
+                if state["complete"]:
+                    break
+                previous_oldest = state["oldest_id"]
+                state = await telegram_scheduler.run(self.user, Priority.HISTORY, fetch_older_posts, self.user, channel, state)
+
+            if self.bot and self.bot.is_connected:
+                posts = database.load_posts(channel, previous_oldest, HISTORY_BATCH)
+                await prefetch_thumbs(self.bot, channel, posts)
+            if state["complete"]:
+                break
+            await asyncio.sleep(self.delay)
+
+        refreshed_at = self.refreshes.pop(channel, None)
+        if refreshed_at is not None:
+            database.delete_stale_posts(channel, refreshed_at)
+        logger.info(f"Finished crawling channel {channel}, {database.count_posts(channel)} posts indexed")
+
@@ -0,0 +1,356 @@
+# database.py
+import os
+import time
+import sqlite3
+import logging
+from config import DATABASE_PATH
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    msg_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    file_size INTEGER,
+    mime_type TEXT,
+    duration INTEGER,
+    thumb_file_id TEXT,
+    thumb_unique_id TEXT,
+    indexed_at REAL NOT NULL DEFAULT 0,
+    UNIQUE (channel, msg_id)
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel TEXT PRIMARY KEY,
+    oldest_id INTEGER,
+    newest_id INTEGER,
+    complete INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS file_ids (
+    account INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    msg_id INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    file_size INTEGER,
+    mime_type TEXT,
+    file_name TEXT,
+    unique_id TEXT,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, channel, msg_id)
+);
+"""
+
+# full text index over the post titles, kept in sync with the posts table by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    title, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, title) VALUES (new.id, new.title);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title) VALUES ('delete', old.id, old.title);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_au AFTER UPDATE OF title ON posts BEGIN
+    INSERT INTO posts_fts (posts_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    INSERT INTO posts_fts (rowid, title) VALUES (new.id, new.title);
+END;
+"""
+
+connection = None
+fts_enabled = False
+
+
+def get_db() -> sqlite3.Connection:
+    """
+    Returns the shared SQLite connection, opening it in WAL mode on first use.
+    """
+    global connection, fts_enabled
+    if connection is None:
+        db_dir = os.path.dirname(DATABASE_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        connection = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            fts_enabled = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 not available, search falls back to LIKE: {e}")
+        logger.info(f"Opened post database at {DATABASE_PATH}")
+    return connection
+
+
+# --- Posts ---
+
+POST_COLUMNS = "msg_id, title, file_size, mime_type, duration, thumb_unique_id"
+
+
+def save_posts(channel, posts):
+    db = get_db()
+    now = time.time()
+    with db:
+        db.executemany(
+            "INSERT INTO posts (channel, msg_id, title, file_size, mime_type, duration, thumb_unique_id, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (channel, msg_id) DO UPDATE SET title = excluded.title, file_size = excluded.file_size, "
+            "mime_type = excluded.mime_type, duration = excluded.duration, indexed_at = excluded.indexed_at, "
+            "thumb_unique_id = COALESCE(excluded.thumb_unique_id, posts.thumb_unique_id)",
+            [
+                (
+                    str(channel),
+                    post["msg-id"],
+                    post["title"],
+                    post.get("size"),
+                    post.get("mime"),
+                    post.get("duration"),
+                    post.get("thumb"),
+                    now,
+                )
+                for post in posts
+            ],
+        )
+
+
+def post_record(row):
+    return {
+        "msg-id": row["msg_id"],
+        "title": row["title"],
+        "size": row["file_size"],
+        "mime": row["mime_type"],
+        "duration": row["duration"],
+        "thumb": row["thumb_unique_id"],
+    }
+
+
+def load_posts(channel, before_id=None, limit=50):
+    """
+    Keyset pagination, returns up to `limit` posts older than `before_id`, newest first.
+    """
+    db = get_db()
+    if before_id is None:
+        rows = db.execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE channel = ? ORDER BY msg_id DESC LIMIT ?",
+            (str(channel), limit),
+        )
+    else:
+        rows = db.execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE channel = ? AND msg_id < ? ORDER BY msg_id DESC LIMIT ?",
+            (str(channel), before_id, limit),
+        )
+    return [post_record(row) for row in rows]
+
+
+# stored as the thumb_file_id of posts the bot found no thumbnail for, so they aren't looked up again
+NO_THUMB = ""
+
+
+def save_thumbs(channel, thumbs):
+    """
+    Stores the bot's thumbnail file ids with the post records, NO_THUMB for posts without one.
+    """
+    db = get_db()
+    with db:
+        db.executemany(
+            "UPDATE posts SET thumb_file_id = ?, thumb_unique_id = COALESCE(?, thumb_unique_id) "
+            "WHERE channel = ? AND msg_id = ?",
+            [(thumb["file_id"], thumb["unique_id"], str(channel), thumb["msg-id"]) for thumb in thumbs],
+        )
+
+
+def get_thumb(channel, msg_id):
+    """
+    Returns the stored thumbnail of a post, its file id is NO_THUMB when it has none, None when unknown.
+    """
+    row = get_db().execute(
+        "SELECT thumb_file_id, thumb_unique_id FROM posts WHERE channel = ? AND msg_id = ?",
+        (str(channel), msg_id),
+    ).fetchone()
+    if row and row["thumb_file_id"] is not None:
+        return {"file_id": row["thumb_file_id"], "unique_id": row["thumb_unique_id"]}
+    return None
+
+
+def get_thumbs(channel, msg_ids):
+    """
+    Returns {msg_id: thumbnail file id} of the given posts whose thumbnail is known, see get_thumb.
+    """
+    if not msg_ids:
+        return {}
+    rows = get_db().execute(
+        f"SELECT msg_id, thumb_file_id FROM posts WHERE channel = ? AND thumb_file_id IS NOT NULL "
+        f"AND msg_id IN ({', '.join('?' * len(msg_ids))})",
+        (str(channel), *msg_ids),
+    )
+    return {row["msg_id"]: row["thumb_file_id"] for row in rows}
+
+
+def page_anchor(channel, page, page_size=50):
+    """
+    Returns the message id the given page starts below, None for the first page.
+    Only walks the (channel, msg_id) index.
+    """
+    if page <= 1:
+        return None
+    row = get_db().execute(
+        "SELECT msg_id FROM posts WHERE channel = ? ORDER BY msg_id DESC LIMIT 1 OFFSET ?",
+        (str(channel), (page - 1) * page_size - 1),
+    ).fetchone()
+    return row["msg_id"] if row else 0
+
+
+def count_posts(channel):
+    row = get_db().execute(
+        "SELECT COUNT(*) FROM posts WHERE channel = ?", (str(channel),)
+    ).fetchone()
+    return row[0]
+
+
+def fts_query(query):
+    """
+    Turns free text into an FTS5 query, every word must match and the last one may be a prefix.
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if not words:
+        return None
+    words[-1] += "*"
+    return " ".join(words)
+
+
+def search_posts(channel, query, limit=50):
+    """
+    Returns the posts of a channel matching `query`, best match first.
+    """
+    db = get_db()
+    if fts_enabled:
+        match = fts_query(query)
+        if not match:
+            return []
+        rows = db.execute(
+            "SELECT posts.msg_id, posts.title, posts.file_size, posts.mime_type, posts.duration, posts.thumb_unique_id "
+            "FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid "
+            "WHERE posts_fts MATCH ? AND posts.channel = ? ORDER BY bm25(posts_fts), posts.msg_id DESC LIMIT ?",
+            (match, str(channel), limit),
+        )
+    else:
+        rows = db.execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE channel = ? AND title LIKE ? ORDER BY msg_id DESC LIMIT ?",
+            (str(channel), f"%{query.strip()}%", limit),
+        )
+    return [post_record(row) for row in rows]
+
+
+# --- Streamed file ids ---
+
+def load_file_id(account, channel, msg_id):
+    """
+    Returns the stored file id of a message as the account got it, None when unknown.
+    File ids are kept per Telegram account id since they can only be used by the account that fetched them,
+    a client's session name doesn't say which bot it is logged in as.
+    """
+    row = get_db().execute(
+        "SELECT file_id, file_size, mime_type, file_name, unique_id FROM file_ids "
+        "WHERE account = ? AND channel = ? AND msg_id = ?",
+        (account, str(channel), msg_id),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def save_file_id(account, channel, msg_id, record):
+    db = get_db()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO file_ids "
+            "(account, channel, msg_id, file_id, file_size, mime_type, file_name, unique_id, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                account,
+                str(channel),
+                msg_id,
+                record["file_id"],
+                record["file_size"],
+                record["mime_type"],
+                record["file_name"],
+                record["unique_id"],
+                time.time(),
+            ),
+        )
+
+
+# --- Channel sync state ---
+
+def get_channel_state(channel):
+    """
+    Returns how far a channel is indexed: the oldest and newest message ids seen,
+    whether the history is complete and when newer messages were last synced.
+    """
+    row = get_db().execute(
+        "SELECT oldest_id, newest_id, complete, synced_at FROM channels WHERE channel = ?",
+        (str(channel),),
+    ).fetchone()
+    if row:
+        return {
+            "oldest_id": row["oldest_id"],
+            "newest_id": row["newest_id"],
+            "complete": bool(row["complete"]),
+            "synced_at": row["synced_at"],
+        }
+    return None
+
+
+def reset_channel_progress(channel):
+    """
+    Marks a channel's history as not crawled, keeping its posts.
+    """
+    db = get_db()
+    with db:
+        db.execute("UPDATE channels SET oldest_id = NULL, complete = 0 WHERE channel = ?", (str(channel),))
+
+
+def set_channel_state(channel, state):
+    db = get_db()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO channels (channel, oldest_id, newest_id, complete, synced_at) VALUES (?, ?, ?, ?, ?)",
+            (str(channel), state["oldest_id"], state["newest_id"], int(state["complete"]), state["synced_at"]),
+        )
+
+
+# --- Invalidation ---
+
+def delete_channel(channel):
+    db = get_db()
+    with db:
+        cur = db.execute("DELETE FROM posts WHERE channel = ?", (str(channel),))
+        db.execute("DELETE FROM channels WHERE channel = ?", (str(channel),))
+        db.execute("DELETE FROM file_ids WHERE channel = ?", (str(channel),))
+    logger.info(f"Removed {cur.rowcount} cached posts for {channel}")
+
+
+def delete_stale_posts(channel, before):
+    """
+    Removes the posts of a channel not indexed again since `before`, after a full refresh.
+    """
+    db = get_db()
+    with db:
+        cur = db.execute("DELETE FROM posts WHERE channel = ? AND indexed_at < ?", (str(channel), before))
+    logger.info(f"Removed {cur.rowcount} stale posts for {channel}")
+
+
+def delete_all():
+    db = get_db()
+    with db:
+        db.execute("DELETE FROM posts")
+        db.execute("DELETE FROM channels")
+        db.execute("DELETE FROM file_ids")
+    logger.info("Removed all cached posts")
@@ -0,0 +1,130 @@
+# gateway.py
+import json
+import uuid
+import logging
+from typing import Optional, Tuple
+import httpx
+from fastapi import HTTPException
+from pyrogram.file_id import FileId
+from bot import PAGE_SIZE
+from utils import ByteStreamer
+
+logger = logging.getLogger("gateway")
+
+
+class GatewayClient:
+    def __init__(self, socket_path: str, timeout: float = 60):
+        """Talks to the gateway process, the only one logged in to Telegram, over its Unix socket.
+        attributes:
+            socket_path: the socket the gateway's uvicorn listens on.
+            http: the connection pool, kept open for the life of the worker.
+
+        HTTP workers use it in place of the Pyrogram clients for everything that needs Telegram:
+        pages of posts, thumbnails, file properties and the parts of streamed files.
+        """
+        self.socket_path = socket_path
+        self.http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=socket_path),
+            base_url="http://gateway/internal",
+            timeout=timeout,
+        )
+
+    async def close(self):
+        await self.http.aclose()
+
+    @staticmethod
+    async def raise_for_status(response: httpx.Response):
+        if response.status_code >= 400:
+            await response.aread()
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            raise HTTPException(status_code=response.status_code, detail=detail)
+
+    async def ready(self) -> Tuple[int, dict]:
+        """
+        Returns the gateway's /readyz status code and body, a worker is ready when its gateway is.
+        """
+        try:
+            response = await self.http.get("http://gateway/readyz")
+            return response.status_code, response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return 503, {"ready": False, "gateway": f"unreachable: {e}"}
+
+    async def metrics(self) -> str:
+        """
+        Returns the gateway's /metrics text, the Telegram side of every stream is only counted there.
+        """
+        try:
+            response = await self.http.get("http://gateway/metrics")
+            response.raise_for_status()
+            return response.text
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to get the gateway's metrics: {e}")
+            return ""
+
+    async def iter_posts(self, channel, page: int = 1, before_id=None, limit: int = PAGE_SIZE):
+        """
+        Yields a page of posts like bot.iter_posts, the gateway streams them as they are indexed.
+        """
+        params = {"page": page, "limit": limit}
+        if before_id is not None:
+            params["before_id"] = before_id
+        async with self.http.stream("GET", f"/posts/{channel}", params=params) as response:
+            await self.raise_for_status(response)
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def get_thumb(self, channel, message_id: int) -> Optional[Tuple[bytes, str]]:
+        """
+        Returns a thumbnail as (bytes, etag) like bot.get_thumb_bytes. Thumbnails are only cached
+        by the gateway, so /clean_cache there takes effect for every worker.
+        """
+        response = await self.http.get(f"/thumb/{channel}/{message_id}")
+        if response.status_code == 404:
+            return None
+        await self.raise_for_status(response)
+        return response.content, response.headers["ETag"]
+
+
+class RemoteStreamer(ByteStreamer):
+    def __init__(self, gateway: GatewayClient):
+        """A ByteStreamer whose file properties and parts come from the gateway.
+        The gateway keeps the file id and chunk caches shared by every worker, so none are kept here.
+        """
+        self.gateway = gateway
+        self.client = None
+        self.chunk_cache = None
+        self.media_sessions = None
+
+    async def get_file_properties(self, channel, message_id: int) -> FileId:
+        # every request is one stream, the gateway serves it and all of its parts with the same client
+        stream = uuid.uuid4().hex
+        response = await self.gateway.http.get(f"/file/{channel}/{message_id}", params={"stream": stream})
+        await self.gateway.raise_for_status(response)
+        properties = response.json()
+        file_id = FileId.decode(properties["file_id"])
+        for name in ("file_size", "mime_type", "file_name", "unique_id"):
+            setattr(file_id, name, properties[name])
+        # the parts are asked for by message, the gateway resolves them with its own cache
+        setattr(file_id, "channel", channel)
+        setattr(file_id, "message_id", message_id)
+        setattr(file_id, "stream", stream)
+        return file_id
+
+    async def get_part(self, file_id: FileId, part_offset: int, chunk_size: int) -> bytes:
+        """
+        Returns one part from the gateway. Errors are raised, a stream must not end short of its Content-Length.
+        """
+        try:
+            response = await self.gateway.http.get(
+                f"/part/{file_id.channel}/{file_id.message_id}",
+                params={"offset": part_offset, "limit": chunk_size, "stream": file_id.stream},
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"Error getting part {part_offset} of {file_id.unique_id} from the gateway: {e}")
+            raise
+        await self.gateway.raise_for_status(response)
+        return response.content
@@ -1,6 +1,6 @@
-def posts_html(posts, channel):
-    html = ""
-    phtml = """<a href="/stream/{channel}/{id}"><div class="col">
+import re
+
+POST_HTML = """<a href="/stream/{channel}/{id}"><div class="col">
                     <div class="card shadow-sm">
                         <img class="lzy_img" src="https://cdn.jsdelivr.net/gh/TechShreyash/AnimeDex@main/static/img/loading.gif" data-src="{img}" alt="{title}">
                         </img>
@@ -9,11 +9,32 @@ def posts_html(posts, channel):
                         </div>
                     </div>
                 </div></a>"""
-    for post in posts:
-        html += phtml.format(
-            id=post["msg-id"],
-            img=f"/api/thumb/{channel}/{post['msg-id']}",
-            title=post["title"],
-            channel=channel,
-        )
-    return html
+
+
+def post_html(post, channel):
+    return POST_HTML.format(
+        id=post["msg-id"],
+        img=f"/api/thumb/{channel}/{post['msg-id']}",
+        title=post["title"],
+        channel=channel,
+    )
+
+
+def posts_html(posts, channel):
+    return "".join(post_html(post, channel) for post in posts)
+
+
+def compile_template(template, placeholders):
+    """
+    Splits a template once into ("text", segment) and ("var", placeholder) pieces,
+    so pages can be streamed piece by piece without replace passes.
+    """
+    pattern = re.compile("|".join(re.escape(placeholder) for placeholder in placeholders))
+    pieces = []
+    position = 0
+    for match in pattern.finditer(template):
+        pieces.append(("text", template[position:match.start()]))
+        pieces.append(("var", match.group()))
+        position = match.end()
+    pieces.append(("text", template[position:]))
+    return pieces
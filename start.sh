@@ -0,0 +1,42 @@
+#!/bin/sh
+# start.sh
+# With HTTP_WORKERS above 1 a gateway process owns the Telegram clients,
+# the HTTP workers reach it over the GATEWAY_SOCKET Unix socket.
+PORT="${PORT:-80}"
+HTTP_WORKERS="${HTTP_WORKERS:-1}"
+export GATEWAY_SOCKET="${GATEWAY_SOCKET:-/tmp/techzindex-gateway.sock}"
+
+if [ "$HTTP_WORKERS" -le 1 ]; then
+    exec uvicorn web:app --host 0.0.0.0 --port "$PORT"
+fi
+
+rm -f "$GATEWAY_SOCKET"
+# the workers log their own requests, the gateway would add a line per part of every stream
+ROLE=gateway uvicorn web:app --uds "$GATEWAY_SOCKET" --no-access-log &
+GATEWAY_PID=$!
+WORKER_PID=""
+
+# both run in the background so the shell gets SIGTERM at once and passes it on for a graceful shutdown,
+# the workers first, the gateway once they finished their requests
+stop() {
+    kill -TERM "${WORKER_PID:-$GATEWAY_PID}" 2>/dev/null
+}
+trap stop INT TERM
+
+while [ ! -S "$GATEWAY_SOCKET" ]; do
+    if ! kill -0 "$GATEWAY_PID" 2>/dev/null; then
+        echo "Gateway process exited before listening on $GATEWAY_SOCKET" >&2
+        exit 1
+    fi
+    sleep 0.5
+done
+
+ROLE=worker uvicorn web:app --host 0.0.0.0 --port "$PORT" --workers "$HTTP_WORKERS" &
+WORKER_PID=$!
+
+# wait returns as soon as a trapped signal arrives, the workers are then waited for until they exit
+while kill -0 "$WORKER_PID" 2>/dev/null; do
+    wait "$WORKER_PID"
+done
+kill -TERM "$GATEWAY_PID" 2>/dev/null
+wait "$GATEWAY_PID"
@@ -1,61 +1,221 @@
-import math
+import time
+import uuid
 import logging
 import mimetypes
 import utils
+import database
+from config import STREAM_PREFETCH, CHUNK_CACHE_DIR, CHUNK_CACHE_SIZE, MEDIA_SESSIONS_PER_DC, WARM_DCS
 from fastapi.responses import StreamingResponse, Response
+from utils.metrics import active_streams, cache_hits, cache_misses, media_sessions, stream_ttfb_seconds
 
 logger = logging.getLogger("streamer")
 
 
 class_cache = {}
+work_loads = {}
+chunk_cache = None
+# set in HTTP workers, every stream then goes through the gateway process
+remote_streamer = None
 
 
-async def media_streamer(bot, channel, message_id: int, request):
-    range_header = request.headers.get("Range", 0)
+def get_chunk_cache():
+    """Returns the disk cache shared by every ByteStreamer, created on first use."""
+    global chunk_cache
+    if chunk_cache is None and CHUNK_CACHE_SIZE > 0:
+        chunk_cache = utils.ChunkCache(CHUNK_CACHE_DIR, CHUNK_CACHE_SIZE)
+    return chunk_cache
 
-    faster_client = bot
 
-    if faster_client in class_cache:
-        tg_connect = class_cache[faster_client]
+def get_byte_streamer(client):
+    if client in class_cache:
         logger.debug(f"Using cached ByteStreamer object for client")
-    else:
-        logger.debug(f"Creating new ByteStreamer object for client")
-        tg_connect = utils.ByteStreamer(faster_client)
-        class_cache[faster_client] = tg_connect
+        return class_cache[client]
+    logger.debug(f"Creating new ByteStreamer object for client")
+    tg_connect = utils.ByteStreamer(client, get_chunk_cache(), MEDIA_SESSIONS_PER_DC, database)
+    class_cache[client] = tg_connect
+    return tg_connect
 
-    logger.debug("before calling get_file_properties")
-    file_id = await tg_connect.get_file_properties(channel, message_id)
-    logger.debug("after calling get_file_properties")
 
-    file_size = file_id.file_size
+async def warm_up(client):
+    """Opens the media sessions of the common DCs before the first stream needs them."""
+    await get_byte_streamer(client).media_sessions.warm_up(WARM_DCS)
+
+
+async def stop_streamers():
+    for tg_connect in class_cache.values():
+        await tg_connect.media_sessions.stop()
+    class_cache.clear()
+
+
+def clear_file_ids(channel=None):
+    """Drops the cached file ids of one channel, or all of them, from every ByteStreamer."""
+    for tg_connect in class_cache.values():
+        tg_connect.cached_file_ids.clear(channel)
+
+
+def use_remote_streamer(tg_connect):
+    """Streams through `tg_connect` instead of this process' own clients, see gateway.RemoteStreamer."""
+    global remote_streamer
+    remote_streamer = tg_connect
+
+
+def register_client(client):
+    """Adds a started client to the pool used for streaming."""
+    work_loads.setdefault(client, 0)
+
+
+def unregister_client(client):
+    work_loads.pop(client, None)
+
+
+def get_faster_client(default):
+    """Returns the client with the fewest active streams, falls back to `default`."""
+    if not work_loads:
+        return default
+    return min(work_loads, key=work_loads.get)
+
+
+def acquire_client(client):
+    """Counts a stream on `client` as soon as it is chosen, so a burst of requests is spread out."""
+    work_loads[client] = work_loads.get(client, 0) + 1
+
+
+def release_client(client):
+    if client in work_loads:
+        work_loads[client] -= 1
+
+
+class StreamLoad:
+    def __init__(self, client):
+        """The load a stream takes on its client, released exactly once however the stream ends."""
+        self.client = client
+        self.released = False
+        acquire_client(client)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            release_client(self.client)
+
+
+class LoadedStreamingResponse(StreamingResponse):
+    def __init__(self, *args, load: StreamLoad, **kwargs):
+        """A StreamingResponse releasing its stream's load even when it is cancelled before its body starts."""
+        super().__init__(*args, **kwargs)
+        self.load = load
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.load.release()
+
+
+async def track_load(load: StreamLoad, body, started: float):
+    """Yields the body of a stream, releasing its load when it ends."""
+    first = True
+    try:
+        async for chunk in body:
+            if first:
+                stream_ttfb_seconds.time(started)
+                first = False
+            yield chunk
+    finally:
+        load.release()
 
-    if range_header:
-        from_bytes, until_bytes = range_header.replace("bytes=", "").split("-")
-        from_bytes = int(from_bytes)
-        until_bytes = int(until_bytes) if until_bytes else file_size - 1
+
+# --- Streams of the HTTP workers, in the gateway process ---
+# stream id -> (client, monotonic time of its last part)
+remote_streams = {}
+# the gateway doesn't see a worker's response end, a stream is over once no part was asked for this long
+REMOTE_STREAM_IDLE = 30
+
+
+def remote_stream_client(stream: str, default):
+    """
+    Returns the client serving a worker's stream, the least loaded one for its first part.
+    The stream keeps that client, and counts in its load, until it is idle.
+    """
+    now = time.monotonic()
+    for key, (client, last_part) in list(remote_streams.items()):
+        if now - last_part > REMOTE_STREAM_IDLE:
+            del remote_streams[key]
+            release_client(client)
+    if stream in remote_streams:
+        client = remote_streams[stream][0]
     else:
-        from_bytes = 0
-        until_bytes = file_size - 1
-
-    if (until_bytes > file_size) or (from_bytes < 0) or (until_bytes < from_bytes):
-        return Response(
-            status_code=416,
-            content="416: Range not satisfiable",
-            headers={"Content-Range": f"bytes */{file_size}"},
-        )
+        client = get_faster_client(default)
+        acquire_client(client)
+    remote_streams[stream] = (client, now)
+    return client
+
+
+# --- Metrics, read from the state above at scrape time ---
+
+def client_name(client):
+    return getattr(client, "name", str(client))
+
 
-    chunk_size = 1024 * 1024
-    until_bytes = min(until_bytes, file_size - 1)
+active_streams.add_function(lambda: {(client_name(client),): load for client, load in work_loads.items()})
+media_sessions.add_function(
+    lambda: {
+        (client_name(client), str(dc_id)): len(sessions)
+        for client, tg_connect in class_cache.items()
+        for dc_id, sessions in tg_connect.media_sessions.sessions.items()
+    }
+)
+cache_hits.add_function(lambda: {("file_ids",): sum(t.cached_file_ids.hits for t in class_cache.values())})
+cache_misses.add_function(lambda: {("file_ids",): sum(t.cached_file_ids.misses for t in class_cache.values())})
 
-    offset = from_bytes - (from_bytes % chunk_size)
-    first_part_cut = from_bytes - offset
-    last_part_cut = until_bytes % chunk_size + 1
 
-    req_length = until_bytes - from_bytes + 1
-    part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
-    body = tg_connect.yield_file(
-        file_id, offset, first_part_cut, last_part_cut, part_count, chunk_size
+def stream_range(tg_connect, file_id, from_bytes: int, until_bytes: int):
+    # small probes get one small fetch, long reads ramp up to 1 MB parts
+    parts = utils.plan_parts(from_bytes, until_bytes)
+    first_part_cut = from_bytes - parts[0][0]
+    last_part_cut = until_bytes - parts[-1][0] + 1
+    return tg_connect.yield_file(
+        file_id,
+        parts,
+        first_part_cut,
+        last_part_cut,
+        prefetch=STREAM_PREFETCH,
     )
+
+
+async def multipart_body(tg_connect, file_id, ranges, part_headers, closing):
+    for (from_bytes, until_bytes), part_header in zip(ranges, part_headers):
+        yield part_header
+        async for chunk in stream_range(tg_connect, file_id, from_bytes, until_bytes):
+            yield chunk
+    yield closing
+
+
+async def media_streamer(bot, channel, message_id: int, request):
+    started = time.perf_counter()
+    if remote_streamer:
+        faster_client, tg_connect = "gateway", remote_streamer
+    else:
+        faster_client = get_faster_client(bot)
+        logger.debug(f"Using client with {work_loads.get(faster_client, 0)} active streams")
+        tg_connect = get_byte_streamer(faster_client)
+    load = StreamLoad(faster_client)
+    streaming = False
+    try:
+        response = await stream_response(tg_connect, load, channel, message_id, request, started)
+        streaming = isinstance(response, LoadedStreamingResponse)
+        return response
+    finally:
+        # the response releases the client once sent, HEAD, 416 and errors never start one
+        if not streaming:
+            load.release()
+
+
+async def stream_response(tg_connect, load: StreamLoad, channel, message_id: int, request, started: float):
+    logger.debug("before calling get_file_properties")
+    file_id = await tg_connect.get_file_properties(channel, message_id)
+    logger.debug("after calling get_file_properties")
+
+    file_size = file_id.file_size
     mime_type = file_id.mime_type
     file_name = utils.get_name(file_id)
     disposition = "attachment"
@@ -66,15 +226,70 @@ async def media_streamer(bot, channel, message_id: int, request):
     if "video/" in mime_type or "audio/" in mime_type or "/html" in mime_type:
         disposition = "inline"
 
-    return StreamingResponse(
-        status_code=206 if range_header else 200,
-        content=body,
-        headers={
-            "Content-Type": f"{mime_type}",
-            "Content-Range": f"bytes {from_bytes}-{until_bytes}/{file_size}",
-            "Content-Length": str(req_length),
-            "Content-Disposition": f'{disposition}; filename="{file_name}"',
-            "Accept-Ranges": "bytes",
-        },
-        media_type=mime_type,
+    etag = f'"{file_id.unique_id}"'
+    headers = {
+        "Content-Type": f"{mime_type}",
+        "Content-Disposition": f'{disposition}; filename="{file_name}"',
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+    }
+
+    ranges = None
+    range_header = request.headers.get("Range")
+    if range_header and utils.if_range_matches(request.headers.get("If-Range"), etag):
+        try:
+            ranges = utils.parse_range(range_header, file_size)
+        except utils.RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                content="416: Range not satisfiable",
+                headers={"Content-Range": f"bytes */{file_size}"},
+            )
+
+    is_head = request.method == "HEAD"
+
+    if not ranges:
+        status_code = 200
+        headers["Content-Length"] = str(file_size)
+        if is_head or not file_size:
+            return Response(status_code=status_code, headers=headers)
+        body = stream_range(tg_connect, file_id, 0, file_size - 1)
+
+    elif len(ranges) == 1:
+        status_code = 206
+        from_bytes, until_bytes = ranges[0]
+        headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+        headers["Content-Length"] = str(until_bytes - from_bytes + 1)
+        if is_head:
+            return Response(status_code=status_code, headers=headers)
+        body = stream_range(tg_connect, file_id, from_bytes, until_bytes)
+
+    else:
+        status_code = 206
+        boundary = uuid.uuid4().hex
+        part_headers = [
+            (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {mime_type}\r\n"
+                f"Content-Range: bytes {from_bytes}-{until_bytes}/{file_size}\r\n\r\n"
+            ).encode()
+            for from_bytes, until_bytes in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["Content-Length"] = str(
+            sum(len(h) for h in part_headers)
+            + sum(until_bytes - from_bytes + 1 for from_bytes, until_bytes in ranges)
+            + len(closing)
+        )
+        if is_head:
+            return Response(status_code=status_code, headers=headers)
+        body = multipart_body(tg_connect, file_id, ranges, part_headers, closing)
+
+    return LoadedStreamingResponse(
+        status_code=status_code,
+        content=track_load(load, body, started),
+        headers=headers,
+        media_type=headers["Content-Type"],
+        load=load,
     )
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# the project modules read their config on import, point the caches at a throwaway directory first
+TEST_DIR = tempfile.mkdtemp(prefix="techzindex-tests-")
+os.environ.setdefault("DATABASE_PATH", os.path.join(TEST_DIR, "index.db"))
+os.environ.setdefault("CHUNK_CACHE_DIR", os.path.join(TEST_DIR, "chunks"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,201 @@
+import random
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import RangeNotSatisfiable, parse_range
+from utils.ranges import MAX_RANGES
+from bench.fake_telegram import FakeClient, FakeTelegram, install
+import streamer
+
+SEED = 20241017
+
+
+def random_spec(rng: random.Random, file_size: int) -> str:
+    kind = rng.randrange(3)
+    start = rng.randrange(file_size + 10)
+    if kind == 0:
+        return f"{start}-{start + rng.randrange(file_size)}"
+    if kind == 1:
+        return f"{start}-"
+    return f"-{rng.randrange(1, file_size + 10)}"
+
+
+def expected_bytes(specs, file_size: int) -> set:
+    """The byte offsets the specs select, one range at a time."""
+    selected = set()
+    for spec in specs:
+        start, _, end = spec.partition("-")
+        if not start:
+            selected.update(range(max(file_size - int(end), 0), file_size))
+        else:
+            last = int(end) if end else file_size - 1
+            selected.update(range(int(start), min(last, file_size - 1) + 1))
+    return selected
+
+
+# --- parse_range ---
+
+def test_single_ranges():
+    assert parse_range("bytes=0-99", 1000) == [(0, 99)]
+    assert parse_range("bytes=900-", 1000) == [(900, 999)]
+    assert parse_range("bytes=-100", 1000) == [(900, 999)]
+    assert parse_range("bytes=-5000", 1000) == [(0, 999)]
+    assert parse_range("bytes=990-5000", 1000) == [(990, 999)]
+
+
+def test_ranges_are_sorted_and_merged():
+    assert parse_range("bytes=500-599, 0-99", 1000) == [(0, 99), (500, 599)]
+    assert parse_range("bytes=0-99,50-149", 1000) == [(0, 149)]
+    # adjacent ranges are merged too
+    assert parse_range("bytes=0-99,100-199", 1000) == [(0, 199)]
+    assert parse_range("bytes=0-9,-10,5-", 1000) == [(0, 999)]
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "", "bytes", "bytes=", "items=0-9", "bytes=a-9", "bytes=0-b", "bytes=-", "bytes=9-0", "bytes=0-9,x", "bytes=5",
+        "bytes=,", "bytes= , ", "bytes=,,,",
+    ],
+)
+def test_malformed_headers_are_ignored(header):
+    assert parse_range(header, 1000) is None
+
+
+def test_unsatisfiable_ranges():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-", 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=-0", 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=0-", 0)
+
+
+def test_too_many_ranges_collapse():
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES + 1))
+    assert parse_range(header, 1000) == [(0, MAX_RANGES * 10 + 1)]
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES))
+    assert len(parse_range(header, 1000)) == MAX_RANGES
+
+
+def test_random_ranges_select_the_right_bytes():
+    rng = random.Random(SEED)
+    for _ in range(500):
+        file_size = rng.randrange(1, 300)
+        specs = [random_spec(rng, file_size) for _ in range(rng.randrange(1, MAX_RANGES + 4))]
+        header = "bytes=" + ", ".join(specs)
+        selected = expected_bytes(specs, file_size)
+        if not selected:
+            with pytest.raises(RangeNotSatisfiable):
+                parse_range(header, file_size)
+            continue
+
+        ranges = parse_range(header, file_size)
+        assert all(0 <= first <= last < file_size for first, last in ranges)
+        # sorted, and separated by at least one byte, otherwise they would have been merged
+        assert all(prev_last + 1 < first for (_, prev_last), (first, _) in zip(ranges, ranges[1:]))
+        groups = sum(1 for i in selected if i - 1 not in selected)
+        if groups > MAX_RANGES:
+            # collapsed, the single range spans everything selected
+            assert ranges == [(min(selected), max(selected))]
+        else:
+            assert {i for first, last in ranges for i in range(first, last + 1)} == selected
+
+
+# --- media_streamer against the fake Telegram ---
+
+@pytest.fixture(scope="module")
+def backend():
+    backend = FakeTelegram(messages=4, file_size=3 * 1024 * 1024 + 12345, latency=0, bandwidth=0)
+    install(backend)
+    client = FakeClient(backend, "ranges")
+    streamer.register_client(client)
+    yield backend, client
+    asyncio.run(streamer.stop_streamers())
+    streamer.unregister_client(client)
+
+
+def serve(client, headers, method="GET"):
+    async def run():
+        request = SimpleNamespace(headers=headers, method=method)
+        response = await streamer.media_streamer(client, "@ranges", 1, request)
+        body = getattr(response, "body", b"")
+        if hasattr(response, "body_iterator"):
+            body = b"".join([bytes(chunk) async for chunk in response.body_iterator])
+        return response, body
+
+    return asyncio.run(run())
+
+
+def parse_multipart(body: bytes, boundary: str):
+    """Returns the (headers, data) of every part of a multipart/byteranges body."""
+    delimiter = f"\r\n--{boundary}".encode()
+    assert body.startswith(delimiter) and body.endswith(delimiter + b"--\r\n")
+    parts = []
+    for part in body[: -len(delimiter) - 4].split(delimiter)[1:]:
+        head, _, data = part[2:].partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append((headers, data))
+    return parts
+
+
+def test_full_and_head_responses(backend):
+    backend, client = backend
+    response, body = serve(client, {})
+    assert response.status_code == 200
+    assert body == backend.read(0, backend.file_size)
+    assert int(response.headers["Content-Length"]) == backend.file_size
+
+    response, body = serve(client, {"Range": "bytes=10-20"}, "HEAD")
+    assert response.status_code == 206 and body == b""
+    assert response.headers["Content-Length"] == "11"
+    assert response.headers["Content-Range"] == f"bytes 10-20/{backend.file_size}"
+
+
+def test_unsatisfiable_and_malformed_ranges(backend):
+    backend, client = backend
+    response, _ = serve(client, {"Range": f"bytes={backend.file_size}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{backend.file_size}"
+
+    for header in ("bytes=oops", "bytes=,"):
+        response, body = serve(client, {"Range": header})
+        assert response.status_code == 200 and len(body) == backend.file_size
+
+
+def test_if_range_mismatch_serves_the_whole_file(backend):
+    backend, client = backend
+    response, body = serve(client, {"Range": "bytes=0-9", "If-Range": '"another"'})
+    assert response.status_code == 200 and len(body) == backend.file_size
+
+
+def test_random_ranges_are_served_exactly(backend):
+    backend, client = backend
+    rng = random.Random(SEED)
+    file_size = backend.file_size
+    content = backend.read(0, file_size)
+    for _ in range(150):
+        specs = [random_spec(rng, file_size) for _ in range(rng.choice([1, 1, 2, 3, MAX_RANGES + 2]))]
+        header = "bytes=" + ",".join(specs)
+        try:
+            ranges = parse_range(header, file_size)
+        except RangeNotSatisfiable:
+            continue
+        response, body = serve(client, {"Range": header})
+        assert response.status_code == 206
+        assert int(response.headers["Content-Length"]) == len(body)
+
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            assert response.headers["Content-Range"] == f"bytes {first}-{last}/{file_size}"
+            assert body == content[first:last + 1]
+            continue
+
+        content_type = response.headers["Content-Type"]
+        assert content_type.startswith("multipart/byteranges; boundary=")
+        parts = parse_multipart(body, content_type.split("boundary=", 1)[1])
+        assert len(parts) == len(ranges)
+        for (headers, data), (first, last) in zip(parts, ranges):
+            assert headers["Content-Range"] == f"bytes {first}-{last}/{file_size}"
+            assert headers["Content-Type"] == "video/mp4"
+            assert data == content[first:last + 1]
@@ -3,4 +3,9 @@
 
 from .time_format import get_readable_time
 from .file_properties import get_hash, get_name
-from .custom_dl import ByteStreamer
\ No newline at end of file
+from .custom_dl import ByteStreamer, plan_parts
+from .chunk_cache import ChunkCache
+from .lru_cache import LRUCache
+from .ranges import RangeNotSatisfiable, parse_range, if_range_matches
+from .media_sessions import MediaSessionPool
+from .scheduler import Priority, TelegramScheduler, telegram_scheduler
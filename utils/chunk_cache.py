@@ -0,0 +1,116 @@
+import os
+import mmap
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger("streamer")
+
+
+class ChunkCache:
+    def __init__(self, path: str, max_size: int):
+        """A disk backed store for the parts fetched by ByteStreamer.yield_file.
+        attributes:
+            path: the directory the parts are stored in, one sub directory per file unique id.
+            max_size: the size budget in bytes, least recently used parts are evicted past it.
+
+        Parts are keyed by (unique_id, chunk_size, offset), every offset is a multiple of its chunk size
+        so a part can be looked up inside the bigger cached parts containing it.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.entries: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+        os.makedirs(self.path, exist_ok=True)
+        self.load()
+
+    def load(self) -> None:
+        """
+        Indexes the parts left on disk by a previous run, oldest access first.
+        """
+        found = []
+        for unique_id in os.listdir(self.path):
+            file_dir = os.path.join(self.path, unique_id)
+            if not os.path.isdir(file_dir):
+                continue
+            for name in os.listdir(file_dir):
+                try:
+                    chunk_size, offset = map(int, name.split("-"))
+                    stat = os.stat(os.path.join(file_dir, name))
+                except (ValueError, OSError):
+                    continue
+                found.append((stat.st_atime, (unique_id, chunk_size, offset), stat.st_size))
+
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+        self.evict()
+        logger.debug(f"Loaded {len(self.entries)} cached parts ({self.size} bytes)")
+
+    def file_path(self, key: Tuple[str, int, int]) -> str:
+        unique_id, chunk_size, offset = key
+        return os.path.join(self.path, unique_id, f"{chunk_size}-{offset}")
+
+    def get(self, unique_id: str, offset: int, chunk_size: int) -> Optional[memoryview]:
+        """
+        Returns the cached part or None, as a view of the mmapped file so it is never copied.
+        The mapping is released with the last view of it, a removed file stays readable until then.
+        """
+        key = (unique_id, chunk_size, offset)
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.file_path(key), "rb") as f:
+                chunk = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return chunk
+
+    async def put(self, unique_id: str, offset: int, chunk_size: int, chunk: Union[bytes, memoryview]) -> None:
+        """
+        Stores a part without blocking the event loop, then evicts down to the size budget.
+        """
+        key = (unique_id, chunk_size, offset)
+        if not chunk or key in self.entries or len(chunk) > self.max_size:
+            return
+        try:
+            await asyncio.to_thread(self.write, key, chunk)
+        except OSError as e:
+            logger.error(f"Error writing cached part {key}: {e}")
+            return
+        if key in self.entries:
+            return
+        self.entries[key] = len(chunk)
+        self.size += len(chunk)
+        self.evict()
+
+    def write(self, key: Tuple[str, int, int], chunk: Union[bytes, memoryview]) -> None:
+        file_path = self.file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(chunk)
+        os.replace(tmp_path, file_path)
+
+    def discard(self, unique_id: str, offset: int, chunk_size: int) -> None:
+        key = (unique_id, chunk_size, offset)
+        if key in self.entries:
+            self.remove(key)
+
+    def remove(self, key: Tuple[str, int, int]) -> None:
+        self.size -= self.entries.pop(key, 0)
+        file_path = self.file_path(key)
+        try:
+            os.remove(file_path)
+            os.rmdir(os.path.dirname(file_path))
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            key = next(iter(self.entries))
+            self.remove(key)
+            logger.debug(f"Evicted cached part {key}")
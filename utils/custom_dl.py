@@ -1,36 +1,99 @@
 import math
+import time
 import asyncio
 import logging
-from typing import Dict, Union
+from collections import deque
+from typing import List, Optional, Tuple, Union
 from pyrogram import Client, utils, raw
+from .chunk_cache import ChunkCache
+from .lru_cache import LRUCache
+from .media_sessions import MediaSessionPool
+from .single_flight import SingleFlight
+from .scheduler import telegram_scheduler
+from .metrics import stream_bytes, stream_throughput
 from .file_properties import get_file_ids
-from pyrogram.session import Session, Auth
-from pyrogram.errors import AuthBytesInvalid
+from pyrogram.session import Session
+from pyrogram.errors import BadRequest, FileReferenceExpired, FileReferenceInvalid
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
 
 logger = logging.getLogger("streamer")
 
+# shared by every ByteStreamer so viewers on different clients join the same fetch
+part_flights = SingleFlight()
+
+# upload.GetFile limits must be multiples of 4 KB that divide 1 MB
+MIN_CHUNK_SIZE = 4 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+RAMP_START_SIZE = 128 * 1024
+
+
+def plan_parts(from_bytes: int, until_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Returns the (offset, limit) of the GetFile calls covering a byte range.
+    Short ranges get a single small fetch, long ranges start small for a fast first byte
+    and double the limit every time the offset is aligned to it, up to MAX_CHUNK_SIZE.
+    Every offset is a multiple of its limit so no part crosses a 1 MB boundary.
+    """
+    length = until_bytes - from_bytes + 1
+    chunk_size = MIN_CHUNK_SIZE
+    while chunk_size < min(length, RAMP_START_SIZE):
+        chunk_size *= 2
+
+    offset = from_bytes - (from_bytes % chunk_size)
+    parts = []
+    while offset <= until_bytes:
+        parts.append((offset, chunk_size))
+        offset += chunk_size
+        if chunk_size < MAX_CHUNK_SIZE and offset % (chunk_size * 2) == 0:
+            chunk_size *= 2
+    return parts
+
+
+def containing_parts(part_offset: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Returns the (offset, limit) of every part that contains the given one, itself first, up to its 1 MB block.
+    Parts are aligned to their limit, so there is one candidate per size and a part is found
+    inside a bigger one fetched by a viewer who started reading somewhere else.
+    """
+    parts = []
+    size = chunk_size
+    while size <= MAX_CHUNK_SIZE:
+        parts.append((part_offset - part_offset % size, size))
+        size *= 2
+    return parts
+
 
 class ByteStreamer:
-    def __init__(self, client: Client):
+    def __init__(
+        self,
+        client: Client,
+        chunk_cache: Optional[ChunkCache] = None,
+        sessions_per_dc: int = 2,
+        file_id_store=None,
+    ):
         """A custom class that holds the cache of a specific client and class functions.
         attributes:
             client: the client that the cache is for.
-            cached_file_ids: a dict of cached file IDs.
+            cached_file_ids: an LRU cache of file IDs keyed by (channel, message_id).
             cached_file_properties: a dict of cached file properties.
+            chunk_cache: an optional disk cache of the parts, shared between clients.
+            media_sessions: the pool of media sessions of the client, `sessions_per_dc` per DC.
+            file_id_store: an optional persistent store of the file ids, with load_file_id and save_file_id
+                like the database module, so known files need no get_messages after a restart.
 
         functions:
             generate_file_properties: returns the properties for a media of a specific message contained in Tuple.
-            generate_media_session: returns the media session for the DC that contains the media file.
+            generate_media_session: returns a pooled media session for the DC that contains the media file.
             yield_file: yield a file from telegram servers for streaming.
 
         This is a modified version of the <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
-        self.clean_timer = 30 * 60
         self.client: Client = client
-        self.cached_file_ids: Dict[int, FileId] = {}
-        asyncio.create_task(self.clean_cache())
+        self.cached_file_ids = LRUCache(maxsize=2048, ttl=30 * 60)
+        self.chunk_cache = chunk_cache
+        self.media_sessions = MediaSessionPool(client, sessions_per_dc)
+        self.file_id_store = file_id_store
 
     async def get_file_properties(self, channel, message_id: int) -> FileId:
         """
@@ -38,10 +101,61 @@ class ByteStreamer:
         if the properties are cached, then it'll return the cached results.
         or it'll generate the properties from the Message ID and cache them.
         """
-        if message_id not in self.cached_file_ids:
-            await self.generate_file_properties(channel, message_id)
+        file_id = self.cached_file_ids.get((channel, message_id))
+        if file_id is None:
+            file_id = self.load_file_properties(channel, message_id)
+        if file_id is None:
+            file_id = await self.generate_file_properties(channel, message_id)
             logger.debug(f"Cached file properties for message with ID {message_id}")
-        return self.cached_file_ids[message_id]
+        return file_id
+
+    def account_id(self) -> Optional[int]:
+        """
+        The Telegram id of the account the client is logged in as, file ids are only valid for it.
+        """
+        me = getattr(self.client, "me", None)
+        return me.id if me else None
+
+    def load_file_properties(self, channel, message_id: int) -> Optional[FileId]:
+        """
+        Returns the file id kept in the persistent store, None when it has none or it can't be read.
+        """
+        account = self.account_id()
+        if not self.file_id_store or account is None:
+            return None
+        record = self.file_id_store.load_file_id(account, channel, message_id)
+        if not record:
+            return None
+        try:
+            file_id = FileId.decode(record["file_id"])
+        except Exception as e:
+            logger.warning(f"Stored file id of message {message_id} in {channel} is unreadable: {e}")
+            return None
+        for name in ("file_size", "mime_type", "file_name", "unique_id"):
+            setattr(file_id, name, record[name])
+        setattr(file_id, "channel", channel)
+        setattr(file_id, "message_id", message_id)
+        # a stored file id Telegram refuses is replaced by a fresh one, see download_part
+        setattr(file_id, "stored", True)
+        self.cached_file_ids.set((channel, message_id), file_id)
+        return file_id
+
+    def store_file_properties(self, file_id: FileId) -> None:
+        account = self.account_id()
+        if not self.file_id_store or account is None:
+            return
+        self.file_id_store.save_file_id(
+            account,
+            file_id.channel,
+            file_id.message_id,
+            {
+                "file_id": file_id.encode(),
+                "file_size": file_id.file_size,
+                "mime_type": file_id.mime_type,
+                "file_name": file_id.file_name,
+                "unique_id": file_id.unique_id,
+            },
+        )
 
     async def generate_file_properties(self, channel, message_id: int) -> FileId:
         """
@@ -55,65 +169,19 @@ class ByteStreamer:
         if not file_id:
             logger.debug(f"Message with ID {message_id} not found")
             raise Exception("FileNotFound")
-        self.cached_file_ids[message_id] = file_id
+        setattr(file_id, "channel", channel)
+        setattr(file_id, "message_id", message_id)
+        self.cached_file_ids.set((channel, message_id), file_id)
+        self.store_file_properties(file_id)
         logger.debug(f"Cached media message with ID {message_id}")
-        return self.cached_file_ids[message_id]
+        return file_id
 
     async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
         """
-        Generates the media session for the DC that contains the media file.
+        Returns a media session for the DC that contains the media file, from the session pool.
         This is required for getting the bytes from Telegram servers.
         """
-
-        media_session = client.media_sessions.get(file_id.dc_id, None)
-
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await Auth(
-                        client, file_id.dc_id, await client.storage.test_mode()
-                    ).create(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-
-                for _ in range(6):
-                    exported_auth = await client.invoke(
-                        raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id)
-                    )
-
-                    try:
-                        await media_session.invoke(
-                            raw.functions.auth.ImportAuthorization(
-                                id=exported_auth.id, bytes=exported_auth.bytes
-                            )
-                        )
-                        break
-                    except AuthBytesInvalid:
-                        logger.debug(
-                            f"Invalid authorization bytes for DC {file_id.dc_id}"
-                        )
-                        continue
-                else:
-                    await media_session.stop()
-                    raise AuthBytesInvalid
-            else:
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await client.storage.auth_key(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-            logger.debug(f"Created media session for DC {file_id.dc_id}")
-            client.media_sessions[file_id.dc_id] = media_session
-        else:
-            logger.debug(f"Using cached media session for DC {file_id.dc_id}")
-        return media_session
+        return await self.media_sessions.get(file_id.dc_id)
 
     @staticmethod
     async def get_location(
@@ -164,68 +232,140 @@ class ByteStreamer:
             )
         return location
 
+    async def get_part(self, file_id: FileId, part_offset: int, chunk_size: int) -> Optional[Union[bytes, memoryview]]:
+        """
+        Returns one part of the file, from the chunk cache or from Telegram.
+        A part cached or being fetched whole, or as a slice of a bigger part containing it,
+        costs no GetFile call, so do concurrent requests for the same part.
+        """
+        candidates = containing_parts(part_offset, chunk_size)
+        if self.chunk_cache:
+            for offset, limit in candidates:
+                chunk = self.chunk_cache.get(file_id.unique_id, offset, limit)
+                if chunk is not None:
+                    return chunk[part_offset - offset:part_offset - offset + chunk_size]
+
+        for offset, limit in candidates:
+            if part_flights.running((file_id.unique_id, limit, offset)):
+                break
+        else:
+            offset, limit = part_offset, chunk_size
+        chunk = await part_flights.do(
+            (file_id.unique_id, limit, offset), self.download_part, file_id, offset, limit
+        )
+        if chunk is None or limit == chunk_size:
+            return chunk
+        return memoryview(chunk)[part_offset - offset:part_offset - offset + chunk_size]
+
+    async def download_part(self, file_id: FileId, part_offset: int, chunk_size: int) -> Optional[bytes]:
+        for attempt in range(2):
+            file_reference = file_id.file_reference
+            stored = getattr(file_id, "stored", False)
+            # the media session is only needed once a part is missing from the cache,
+            # it is asked for on every attempt since a fresh file id may be on another DC
+            media_session = await self.generate_media_session(self.client, file_id)
+            try:
+                r = await telegram_scheduler.run_media(
+                    self.client,
+                    file_id.dc_id,
+                    media_session.invoke,
+                    raw.functions.upload.GetFile(
+                        location=await self.get_location(file_id), offset=part_offset, limit=chunk_size
+                    ),
+                )
+                break
+            except (FileReferenceExpired, FileReferenceInvalid):
+                if attempt:
+                    raise
+                # parts failing together refresh once, the others retry with the new reference
+                if file_id.file_reference == file_reference:
+                    await self.refresh_file_reference(file_id)
+            except BadRequest as e:
+                if attempt or not stored:
+                    raise
+                logger.warning(f"Stored file id of message {file_id.message_id} in {file_id.channel} failed: {e}")
+                if getattr(file_id, "stored", False):
+                    await self.refresh_file_reference(file_id)
+        if not isinstance(r, raw.types.upload.File):
+            return None
+        if self.chunk_cache:
+            await self.chunk_cache.put(file_id.unique_id, part_offset, chunk_size, r.bytes)
+            # the smaller parts inside this one are now served from it
+            size = chunk_size // 2
+            while size >= MIN_CHUNK_SIZE:
+                for offset in range(part_offset, part_offset + chunk_size, size):
+                    self.chunk_cache.discard(file_id.unique_id, offset, size)
+                size //= 2
+        return r.bytes
+
+    async def refresh_file_reference(self, file_id: FileId) -> None:
+        """
+        Replaces an expired file reference, or a stored file id Telegram refused, with a fresh file id
+        from its message, in place, so every stream holding it continues from where it was.
+        Updates the persistent store too.
+        """
+        logger.info(f"File id of message {file_id.message_id} in {file_id.channel} is stale, refreshing")
+        fresh = await get_file_ids(self.client, file_id.channel, file_id.message_id)
+        if not fresh or fresh.unique_id != file_id.unique_id:
+            raise Exception("FileNotFound")
+        for name, value in vars(fresh).items():
+            setattr(file_id, name, value)
+        file_id.stored = False
+        self.store_file_properties(file_id)
+
     async def yield_file(
         self,
         file_id: FileId,
-        offset: int,
+        parts: List[Tuple[int, int]],
         first_part_cut: int,
         last_part_cut: int,
-        part_count: int,
-        chunk_size: int,
+        prefetch: int = 1,
     ) -> Union[str, None]:
         """
-        Custom generator that yields the bytes of the media file.
+        Custom generator that yields the bytes of the media file, as memoryviews of the parts.
+        `parts` are the (offset, limit) pairs from plan_parts, the first and last one are cut to the range.
+        Up to `prefetch` GetFile requests are kept in flight at once, the parts are still yielded in order.
         Modded from <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py#L20>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
-        client = self.client
         logger.debug(f"Starting to yielding file with client.")
-        media_session = await self.generate_media_session(client, file_id)
 
         current_part = 1
-        location = await self.get_location(file_id)
+
+        part_count = len(parts)
+        pending = deque()
+        requested_parts = 0
+        sent = 0
+        started = time.perf_counter()
 
         try:
-            r = await media_session.invoke(
-                raw.functions.upload.GetFile(
-                    location=location, offset=offset, limit=chunk_size
-                ),
-            )
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
-
-                    current_part += 1
-                    offset += chunk_size
-
-                    if current_part > part_count:
-                        break
-
-                    r = await media_session.invoke(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
-                    )
+            while current_part <= part_count:
+                while len(pending) < max(prefetch, 1) and requested_parts < part_count:
+                    pending.append(asyncio.create_task(self.get_part(file_id, *parts[requested_parts])))
+                    requested_parts += 1
+
+                chunk = await pending.popleft()
+                if not chunk:
+                    break
+                # range cuts are views of the part, its bytes go to the ASGI send uncopied
+                chunk = memoryview(chunk)
+                if part_count == 1:
+                    chunk = chunk[first_part_cut:last_part_cut]
+                elif current_part == 1:
+                    chunk = chunk[first_part_cut:]
+                elif current_part == part_count:
+                    chunk = chunk[:last_part_cut]
+                sent += len(chunk)
+                stream_bytes.inc(len(chunk))
+                yield chunk
+
+                current_part += 1
         except (TimeoutError, AttributeError):
             pass
         finally:
+            for task in pending:
+                task.cancel()
+            elapsed = time.perf_counter() - started
+            if sent and elapsed > 0:
+                stream_throughput.observe(sent / elapsed)
             logger.debug(f"Finished yielding file with {current_part} parts.")
-
-    async def clean_cache(self) -> None:
-        """
-        function to clean the cache to reduce memory usage
-        """
-        while True:
-            await asyncio.sleep(self.clean_timer)
-            self.cached_file_ids.clear()
-            logger.debug("Cleaned the cache")
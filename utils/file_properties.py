@@ -5,6 +5,10 @@ from pyrogram.file_id import FileId
 from typing import Any, Optional, Union
 from pyrogram.raw.types.messages import Messages
 from datetime import datetime
+from .single_flight import SingleFlight
+from .scheduler import Priority, telegram_scheduler
+
+file_id_flights = SingleFlight()
 
 
 async def parse_file_id(message: "Message") -> Optional[FileId]:
@@ -20,7 +24,16 @@ async def parse_file_unique_id(message: "Messages") -> Optional[str]:
 
 
 async def get_file_ids(client: Client, chat_id, message_id) -> Optional[FileId]:
-    message = await client.get_messages(chat_id, int(message_id))
+    """
+    Concurrent calls for the same message on the same client share one get_messages call.
+    """
+    return await file_id_flights.do(
+        (client, chat_id, int(message_id)), fetch_file_ids, client, chat_id, message_id
+    )
+
+
+async def fetch_file_ids(client: Client, chat_id, message_id) -> Optional[FileId]:
+    message = await telegram_scheduler.run(client, Priority.STREAM, client.get_messages, chat_id, int(message_id))
     if message.empty:
         raise Exception("FileNotFound")
     media = get_media_from_message(message)
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        """A size bounded least recently used cache with per entry expiry.
+        attributes:
+            maxsize: the number of entries kept, the least recently used one is evicted past it.
+            ttl: the default lifetime of an entry in seconds, None keeps entries until evicted.
+            hits, misses, evictions, expirations: counters for the cache's stats.
+
+        Keys are usually tuples starting with the channel, the keys of each channel are indexed
+        so one channel can be cleared in time proportional to its own entries.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.namespaces: Dict[Hashable, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        namespace = self.namespace(key)
+        if namespace is not None:
+            self.namespaces.setdefault(namespace, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    @staticmethod
+    def namespace(key: Hashable) -> Optional[Hashable]:
+        return key[0] if isinstance(key, tuple) and key else None
+
+    def remove(self, key: Hashable) -> Optional[tuple]:
+        entry = self.entries.pop(key, None)
+        namespace = self.namespace(key)
+        keys = self.namespaces.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.namespaces[namespace]
+        return entry
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.remove(key)
+        return default if entry is None else entry[0]
+
+    def clear(self, namespace: Hashable = None) -> None:
+        """
+        Removes every entry, or only the tuple keys starting with `namespace`.
+        """
+        if namespace is None:
+            self.entries.clear()
+            self.namespaces.clear()
+            return
+        for key in self.namespaces.pop(namespace, ()):
+            self.entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self.entries)
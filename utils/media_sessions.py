@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import itertools
+from typing import Dict, Iterable, List, Optional
+from pyrogram import Client, raw
+from pyrogram.session import Session, Auth
+from pyrogram.errors import AuthBytesInvalid
+
+logger = logging.getLogger("streamer")
+
+
+class MediaSessionPool:
+    def __init__(self, client: Client, sessions_per_dc: int = 2, health_interval: int = 60):
+        """Keeps the media sessions of a client, several per DC, for ByteStreamer.
+        attributes:
+            client: the client the sessions are authorized for.
+            sessions_per_dc: how many sessions a DC grows to, used round robin.
+            health_interval: seconds between health checks, dead sessions are dropped and recreated.
+
+        Creating a session for a DC is serialized by a per DC lock, so concurrent
+        first requests share the same session instead of each building one.
+        """
+        self.client = client
+        self.sessions_per_dc = max(sessions_per_dc, 1)
+        self.health_interval = health_interval
+        self.sessions: Dict[int, List[Session]] = {}
+        self.locks: Dict[int, asyncio.Lock] = {}
+        self.counter = itertools.count()
+        self.growing: Dict[int, asyncio.Task] = {}
+        self.health_task: Optional[asyncio.Task] = None
+
+    def lock(self, dc_id: int) -> asyncio.Lock:
+        return self.locks.setdefault(dc_id, asyncio.Lock())
+
+    async def get(self, dc_id: int) -> Session:
+        """
+        Returns a session for the DC, only the very first request of a DC waits for one to be created.
+        """
+        self.start()
+        sessions = self.sessions.get(dc_id)
+        if not sessions:
+            async with self.lock(dc_id):
+                sessions = self.sessions.get(dc_id)
+                if not sessions:
+                    await self.add(dc_id)
+                    sessions = self.sessions[dc_id]
+        elif len(sessions) < self.sessions_per_dc and dc_id not in self.growing:
+            task = asyncio.create_task(self.grow(dc_id))
+            self.growing[dc_id] = task
+            task.add_done_callback(lambda _: self.growing.pop(dc_id, None))
+        return sessions[next(self.counter) % len(sessions)]
+
+    async def grow(self, dc_id: int) -> None:
+        async with self.lock(dc_id):
+            try:
+                while len(self.sessions.get(dc_id, [])) < self.sessions_per_dc:
+                    await self.add(dc_id)
+            except Exception as e:
+                logger.error(f"Failed to add a media session for DC {dc_id}: {e}")
+
+    async def add(self, dc_id: int) -> None:
+        session = await self.create(dc_id)
+        self.sessions.setdefault(dc_id, []).append(session)
+        logger.debug(f"Created media session for DC {dc_id} ({len(self.sessions[dc_id])} in pool)")
+
+    async def create(self, dc_id: int) -> Session:
+        """
+        Creates and authorizes a media session for the DC.
+        """
+        client = self.client
+        test_mode = await client.storage.test_mode()
+
+        if dc_id == await client.storage.dc_id():
+            media_session = Session(
+                client,
+                dc_id,
+                await client.storage.auth_key(),
+                test_mode,
+                is_media=True,
+            )
+            await media_session.start()
+            return media_session
+
+        media_session = Session(
+            client,
+            dc_id,
+            await Auth(client, dc_id, test_mode).create(),
+            test_mode,
+            is_media=True,
+        )
+        await media_session.start()
+
+        for _ in range(6):
+            exported_auth = await client.invoke(
+                raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+            )
+
+            try:
+                await media_session.invoke(
+                    raw.functions.auth.ImportAuthorization(
+                        id=exported_auth.id, bytes=exported_auth.bytes
+                    )
+                )
+                return media_session
+            except AuthBytesInvalid:
+                logger.debug(f"Invalid authorization bytes for DC {dc_id}")
+                continue
+
+        await media_session.stop()
+        raise AuthBytesInvalid
+
+    async def warm_up(self, dc_ids: Iterable[int]) -> None:
+        """
+        Creates the sessions of the given DCs ahead of the first viewer.
+        """
+        dc_ids = list(dc_ids)
+        self.start()
+        results = await asyncio.gather(*[self.grow(dc_id) for dc_id in dc_ids], return_exceptions=True)
+        for dc_id, result in zip(dc_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to warm up media sessions for DC {dc_id}: {result}")
+        logger.info(f"Warmed up media sessions for DCs {sorted(self.sessions)}")
+
+    def start(self) -> None:
+        if self.health_task is None or self.health_task.done():
+            self.health_task = asyncio.create_task(self.health_check())
+
+    async def health_check(self) -> None:
+        """
+        Pings every session and replaces the ones that stopped answering.
+        """
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for dc_id, sessions in list(self.sessions.items()):
+                for session in list(sessions):
+                    if await self.is_alive(session):
+                        continue
+                    logger.warning(f"Media session for DC {dc_id} is dead, reconnecting")
+                    sessions.remove(session)
+                    try:
+                        await session.stop()
+                    except Exception:
+                        pass
+                if len(sessions) < self.sessions_per_dc:
+                    await self.grow(dc_id)
+
+    @staticmethod
+    async def is_alive(session: Session) -> bool:
+        if not session.is_started.is_set():
+            return False
+        try:
+            await session.send(raw.functions.Ping(ping_id=0), timeout=10)
+            return True
+        except Exception:
+            return False
+
+    async def stop(self) -> None:
+        if self.health_task:
+            self.health_task.cancel()
+        for sessions in self.sessions.values():
+            for session in sessions:
+                try:
+                    await session.stop()
+                except Exception:
+                    pass
+        self.sessions.clear()
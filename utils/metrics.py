@@ -0,0 +1,191 @@
+import time
+import random
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger("metrics")
+
+# latency buckets in seconds, from cached reads to slow Telegram calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# throughput buckets in bytes per second, 64 KB/s to 64 MB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(6))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        """A metric with one value per set of label values.
+        attributes:
+            name, documentation: the metric's name and HELP text.
+            labelnames: the names of its labels, given as keyword arguments when updating it.
+            functions: called at scrape time for more values, on top of the ones kept.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.functions: List[Callable[[], Dict[Tuple, float]]] = []
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def add_function(self, function: Callable[[], Dict[Tuple, float]]) -> None:
+        """
+        Adds the values of `function` on every scrape, it returns {label values: value}.
+        Suits numbers already counted elsewhere, like cache stats, which then cost nothing per request.
+        """
+        self.functions.append(function)
+
+    def label_text(self, key: Tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        values = self.values
+        if self.functions:
+            values = dict(values)
+            for function in self.functions:
+                try:
+                    values.update(function())
+                except Exception as e:
+                    # a broken collector must not take the whole endpoint down
+                    logger.error(f"Failed to collect {self.name}: {e}")
+        return [f"{self.name}{self.label_text(key)} {value}" for key, value in values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        # per label values: the count of each bucket (not cumulative, the last one is +Inf), the sum
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, started: float, **labels) -> None:
+        """
+        Observes the seconds since `started`, a time.perf_counter() value.
+        """
+        self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+def merge(*texts: str) -> str:
+    """
+    Merges several expositions, e.g. of different processes, into one.
+    Each metric keeps its first HELP and TYPE lines, series found in several texts are summed.
+    """
+    families: Dict[str, Tuple[List[str], Dict[str, float]]] = {}
+    family = None
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = line.split(" ", 3)[2]
+                header, _ = families.setdefault(family, ([], {}))
+                if len(header) < 2 and line not in header:
+                    header.append(line)
+            elif line and not line.startswith("#") and family is not None:
+                series, _, value = line.rpartition(" ")
+                values = families[family][1]
+                values[series] = values.get(series, 0) + float(value)
+    lines = []
+    for header, values in families.values():
+        lines += header + [f"{series} {int(value) if value.is_integer() else value}" for series, value in values.items()]
+    return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class LogSampler(logging.Filter):
+    def __init__(self, rate: float):
+        """Lets through only a `rate` share of DEBUG records, every other level passes.
+        Keeps per request logging affordable at high request rates.
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno != logging.DEBUG or random.random() < self.rate
+
+
+REGISTRY = Registry()
+
+telegram_rpc_seconds = Histogram(
+    "telegram_rpc_seconds", "Latency of Telegram calls, without the time spent rate limited", ["method", "dc"]
+)
+telegram_flood_waits = Counter("telegram_flood_waits_total", "FloodWaits received from Telegram", ["client"])
+stream_bytes = Counter("stream_bytes_total", "Bytes of media sent to viewers")
+stream_throughput = Histogram(
+    "stream_throughput_bytes_per_second", "Average throughput of each finished stream range", buckets=THROUGHPUT_BUCKETS
+)
+stream_ttfb_seconds = Histogram("stream_ttfb_seconds", "Time from a stream request to its first media byte")
+active_streams = Gauge("active_streams", "Streams currently being sent", ["client"])
+media_sessions = Gauge("media_sessions", "Open media sessions", ["client", "dc"])
+cache_hits = Counter("cache_hits_total", "Cache lookups answered from the cache", ["cache"])
+cache_misses = Counter("cache_misses_total", "Cache lookups that had to go to Telegram", ["cache"])
@@ -0,0 +1,77 @@
+from typing import List, Optional, Tuple
+
+# more ranges than this in one request are served as the single range covering them
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses a Range header into sorted, merged, inclusive (start, end) pairs.
+    Supports "a-b", open ended "a-" and suffix "-n" ranges, comma separated.
+    Returns None when the header is malformed and must be ignored,
+    raises RangeNotSatisfiable when no range overlaps the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    specs = 0
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        specs += 1
+        start, sep, end = item.partition("-")
+        start, end = start.strip(), end.strip()
+        if not sep or (start and not start.isdigit()) or (end and not end.isdigit()):
+            return None
+
+        if not start:
+            if not end:
+                return None
+            suffix = int(end)
+            if suffix and file_size:
+                ranges.append((max(file_size - suffix, 0), file_size - 1))
+            continue
+
+        first = int(start)
+        last = int(end) if end else file_size - 1
+        if end and last < first:
+            return None
+        if first < file_size:
+            ranges.append((first, min(last, file_size - 1)))
+
+    # a range set needs at least one range, "bytes=," is malformed rather than unsatisfiable
+    if not specs:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        prev_first, prev_last = merged[-1]
+        if first <= prev_last + 1:
+            merged[-1] = (prev_first, max(prev_last, last))
+        else:
+            merged.append((first, last))
+
+    if len(merged) > MAX_RANGES:
+        return [(merged[0][0], max(last for _, last in merged))]
+    return merged
+
+
+def if_range_matches(if_range: Optional[str], etag: str) -> bool:
+    """
+    Whether the Range header applies. Only a strong ETag can validate If-Range,
+    dates never match since the files carry no Last-Modified.
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    return not if_range.startswith("W/") and if_range == etag
@@ -0,0 +1,159 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pyrogram.errors import FloodWait
+from pyrogram.raw.core import TLObject
+from .metrics import telegram_flood_waits, telegram_rpc_seconds
+
+logger = logging.getLogger("scheduler")
+
+
+class Priority(IntEnum):
+    STREAM = 0
+    THUMB = 1
+    HISTORY = 2
+
+
+class ClientLimiter:
+    def __init__(self, rate: float, burst: int):
+        """A token bucket for one client, handing out tokens by priority.
+        attributes:
+            rate: tokens added per second.
+            burst: the most tokens the bucket holds.
+            paused_until: monotonic time before which no call is let through, set by FloodWait.
+
+        A rate of 0 hands out tokens without limit, calls then only wait for FloodWait pauses.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.dispatcher: Optional[asyncio.Task] = None
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        else:
+            self.tokens = float(self.burst)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Seconds until the next token may be taken.
+        """
+        self.refill()
+        wait = max(self.paused_until - time.monotonic(), 0)
+        if self.rate and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, priority: int) -> None:
+        if not self.waiters and self.delay() == 0:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        await future
+
+    async def dispatch(self) -> None:
+        while self.waiters:
+            if self.waiters[0][2].done():
+                heapq.heappop(self.waiters)
+                continue
+            wait = self.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self.waiters)
+            self.tokens -= 1
+            future.set_result(None)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class TelegramScheduler:
+    def __init__(self, rate: float = 30, burst: int = 60, media_rate: float = 0, max_flood_wait: int = 120):
+        """Runs Telegram RPCs through per client rate limits.
+        attributes:
+            rate, burst: the token bucket of every client's API calls.
+            media_rate: the token bucket of every media session DC of a client, 0 for none.
+            max_flood_wait: FloodWaits longer than this are raised instead of waited out.
+            limiters: the ClientLimiter of each client, and of each (client, media DC).
+            flood_waits: how many FloodWaits each client got.
+
+        A FloodWait only pauses the client, or the media DC, that received it, the call is retried after the wait.
+        Waiting calls are let through by priority, streaming before thumbnails before history.
+        File parts go through the media sessions, not the client's API connection, so they are
+        limited per media DC apart from the history and thumbnail calls.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.media_rate = media_rate
+        self.max_flood_wait = max_flood_wait
+        self.limiters: Dict[Any, ClientLimiter] = {}
+        self.flood_waits: Dict[Any, int] = {}
+
+    def configure(self, rate: float, burst: int, media_rate: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.media_rate = media_rate
+        for key, limiter in self.limiters.items():
+            limiter.rate, limiter.burst = self.bucket(key)
+
+    def bucket(self, key) -> Tuple[float, int]:
+        if isinstance(key, tuple):
+            return self.media_rate, max(int(self.media_rate * 2), 1)
+        return self.rate, self.burst
+
+    def limiter(self, key) -> ClientLimiter:
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = self.limiters[key] = ClientLimiter(*self.bucket(key))
+        return limiter
+
+    async def run(self, client, priority: int, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Runs an API call of `client`.
+        """
+        return await self.call(self.limiter(client), client, "main", priority, func, *args, **kwargs)
+
+    async def run_media(self, client, dc_id: int, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Runs a call on one of `client`'s media sessions of `dc_id`, like upload.GetFile.
+        The session raises every FloodWait, pyrogram would sleep through the short ones itself.
+        """
+        kwargs.setdefault("sleep_threshold", 0)
+        return await self.call(self.limiter((client, dc_id)), client, dc_id, Priority.STREAM, func, *args, **kwargs)
+
+    async def call(self, limiter: ClientLimiter, client, dc, priority: int, func, *args, **kwargs) -> Any:
+        # raw calls are named by their TL function
+        method = type(args[0]).__name__ if args and isinstance(args[0], TLObject) else func.__name__
+        while True:
+            await limiter.acquire(priority)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except FloodWait as e:
+                self.flood_waits[client] = self.flood_waits.get(client, 0) + 1
+                telegram_flood_waits.inc(client=getattr(client, "name", client))
+                if e.value > self.max_flood_wait:
+                    limiter.pause(e.value)
+                    raise
+                logger.warning(f"FloodWait of {e.value}s, pausing {getattr(client, 'name', client)} on DC {dc}")
+                limiter.pause(e.value)
+            finally:
+                telegram_rpc_seconds.time(started, method=method, dc=dc)
+
+
+telegram_scheduler = TelegramScheduler()
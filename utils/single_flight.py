@@ -0,0 +1,35 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        """Shares one in-flight call between concurrent callers asking for the same key.
+        attributes:
+            calls: a dict of the futures currently in flight, removed as soon as they finish.
+
+        Results are not kept once the call is done, caching is left to the caller.
+        """
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        Awaits `func(*args)` or joins the call already running for `key`.
+        A caller being cancelled doesn't cancel the call for the others.
+        """
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self.done(key, f))
+        return await asyncio.shield(future)
+
+    def running(self, key: Hashable) -> bool:
+        return key in self.calls
+
+    def done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # mark the exception as retrieved when every caller went away
+        if not future.cancelled():
+            future.exception()
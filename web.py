@@ -1,20 +1,33 @@
 # web.py
 import os
+import json
+import base64
+import hashlib
 import asyncio
-from streamer import media_streamer
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, Response
-from bot import get_image, get_posts, rm_cache
-from html_gen import posts_html
+from streamer import media_streamer, register_client, unregister_client, warm_up, stop_streamers
+from streamer import get_byte_streamer, get_chunk_cache, remote_stream_client, use_remote_streamer
+from fastapi import APIRouter, FastAPI, Request, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from bot import PAGE_SIZE, get_chat_identifier, iter_posts, rm_cache, index_message, schedule_thumb_prefetch
+from bot import get_cached_thumb, get_thumb_bytes, has_cached_thumb
+from html_gen import posts_html, post_html, compile_template
+from database import get_db, get_channel_state, search_posts
+from utils import telegram_scheduler
+from utils.metrics import REGISTRY, LogSampler, merge as merge_metrics
 from pyrogram.client import Client
-from config import API_ID, API_HASH, BOT_TOKEN, STRING_SESSION, HOME_PAGE_REDIRECT, BASE_URL, OWNER_ID, ADMINS
+from config import API_ID, API_HASH, BOT_TOKEN, STRING_SESSION, HOME_PAGE_REDIRECT, BASE_URL, OWNER_ID, ADMINS, MULTI_BOT_TOKENS, TG_RATE, TG_BURST, TG_MEDIA_RATE
+from config import CRAWL_CHANNELS, CRAWL_WORKERS, CRAWL_DELAY, CRAWL_REFRESH_INTERVAL
+from config import LOG_LEVEL, LOG_SAMPLE_RATE, ROLE, GATEWAY_SOCKET
 from pyrogram import filters
 from pyrogram.types import Message
 import logging
 
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# per request lines are DEBUG and sampled, so enabling them stays cheap under load
+for name in (__name__, "bot", "streamer"):
+    logging.getLogger(name).addFilter(LogSampler(LOG_SAMPLE_RATE))
 
 # --- Pyrogram Clients Initialization ---
 user = None # Initialize to None
@@ -26,6 +39,8 @@ try:
         api_id=API_ID,
         api_hash=API_HASH,
         session_string=STRING_SESSION,
+        # FloodWaits are raised to the scheduler, which pauses the client, instead of slept through by pyrogram
+        sleep_threshold=0,
         # workdir="./sessions/userbot" # Optional: where session file is stored
     )
     logger.info("Pyrogram userbot client initialized successfully in global scope.")
@@ -38,12 +53,30 @@ try:
         api_id=API_ID,
         api_hash=API_HASH,
         bot_token=BOT_TOKEN,
+        sleep_threshold=0,
         # workdir="./sessions/bot" # Optional
     )
     logger.info("Pyrogram bot client initialized successfully in global scope.")
 except Exception as e:
     logger.critical(f"CRITICAL ERROR: Failed to initialize Pyrogram bot client globally: {e}", exc_info=True)
 
+# Extra bot clients, only used to spread streams across more sessions
+stream_clients = []
+for index, token in enumerate(MULTI_BOT_TOKENS, start=1):
+    try:
+        stream_clients.append(
+            Client(
+                f"techzindexbot-{index}",
+                api_id=API_ID,
+                api_hash=API_HASH,
+                bot_token=token,
+                in_memory=True,
+                no_updates=True,
+                sleep_threshold=0,
+            )
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialize stream client {index}: {e}", exc_info=True)
 
 app = FastAPI(docs_url=None, redoc_url=None)
 
@@ -58,37 +91,79 @@ except FileNotFoundError as e:
     HOME_HTML = "<h1>Error: Home template not found</h1><p>Please check your deployment files.</p>"
     STREAM_HTML = "<h1>Error: Stream template not found</h1><p>Please check your deployment files.</p>"
 
+# split once so channel pages are streamed without replace passes
+HOME_TEMPLATE = compile_template(HOME_HTML, ["POSTS", "CHANNEL_ID"])
+
 # --- FastAPI Startup/Shutdown Events ---
+warm_up_tasks = []
+startup_task = None
+crawler = None
+# HTTP workers reach Telegram only through the gateway process
+gateway = None
+
 @app.on_event("startup")
 async def startup_event():
-    logger.info("Starting TG Clients...")
+    global gateway, startup_task
+    if ROLE == "worker":
+        from gateway import GatewayClient, RemoteStreamer
+
+        gateway = GatewayClient(GATEWAY_SOCKET)
+        # httpx logs every request at INFO, here one per part of every stream
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        use_remote_streamer(RemoteStreamer(gateway))
+        logger.info(f"HTTP worker {os.getpid()} started, using the gateway at {GATEWAY_SOCKET}")
+        return
+
+    telegram_scheduler.configure(TG_RATE, TG_BURST, TG_MEDIA_RATE)
     # Ensure directories for cache and downloads exist
     os.makedirs("cache", exist_ok=True)
     os.makedirs("downloads", exist_ok=True)
+    # open the post database and index the chunk cache off the event loop, before the first request
+    await asyncio.gather(asyncio.to_thread(get_db), asyncio.to_thread(get_chunk_cache))
 
-    try:
-        if user:
-            logger.info("Attempting to start userbot client...")
-            await user.start()
-            if user.is_connected:
-                logger.info("Userbot client STARTED and IS CONNECTED successfully.")
-            else:
-                logger.error("Userbot client STARTED but IS NOT CONNECTED after start() call.")
-        else:
-            logger.critical("Userbot client was not initialized globally. Cannot start.")
+    # clients connect in the background, cached pages and thumbnails are served meanwhile, see /readyz
+    startup_task = asyncio.create_task(start_clients())
 
-        if bot:
-            logger.info("Attempting to start bot client...")
-            await bot.start()
-            if bot.is_connected:
-                logger.info("Bot client STARTED and IS CONNECTED successfully.")
-            else:
-                logger.error("Bot client STARTED but IS NOT CONNECTED after start() call.")
-        else:
-            logger.critical("Bot client was not initialized globally. Cannot start.")
 
+async def start_client(client, name: str):
+    if not client:
+        logger.critical(f"{name} client was not initialized globally. Cannot start.")
+        return
+    logger.info(f"Attempting to start {name} client...")
+    try:
+        await client.start()
     except Exception as e:
-        logger.error(f"Failed to start one or more Pyrogram clients during startup: {e}", exc_info=True)
+        logger.error(f"Failed to start {name} client: {e}", exc_info=True)
+        return
+    if client.is_connected:
+        logger.info(f"{name} client STARTED and IS CONNECTED successfully.")
+    else:
+        logger.error(f"{name} client STARTED but IS NOT CONNECTED after start() call.")
+
+
+async def start_clients():
+    logger.info("Starting TG Clients...")
+    await asyncio.gather(
+        start_client(user, "Userbot"),
+        start_client(bot, "Bot"),
+        *[start_client(client, f"Stream {client.name}") for client in stream_clients],
+    )
+
+    for client in [bot] + stream_clients:
+        if client and client.is_connected:
+            register_client(client)
+
+    global crawler
+    if user and user.is_connected:
+        from crawler import Crawler
+
+        crawler = Crawler(CRAWL_WORKERS, CRAWL_DELAY, CRAWL_REFRESH_INTERVAL)
+        crawler.start(user, bot, [get_chat_identifier(channel) for channel in CRAWL_CHANNELS])
+
+    # authorize media sessions in the background so the first viewer of a DC doesn't wait
+    for client in [bot] + stream_clients:
+        if client and client.is_connected:
+            warm_up_tasks.append(asyncio.create_task(warm_up(client)))
     
     logger.info("========================================")
     logger.info("TechZIndex Started Successfully")
@@ -98,7 +173,18 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if gateway:
+        await gateway.close()
+        return
+
     logger.info("Stopping TG Clients...")
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+    for task in warm_up_tasks:
+        task.cancel()
+    if crawler:
+        await crawler.stop()
+    await stop_streamers()
     try:
         if user and user.is_connected:
             await user.stop()
@@ -114,10 +200,48 @@ async def shutdown_event():
              await bot.stop()
     except Exception as e:
         logger.error(f"Error stopping one or more Pyrogram clients: {e}", exc_info=True)
+    for client in stream_clients:
+        unregister_client(client)
+        try:
+            if client.is_connected:
+                await client.stop()
+                logger.info(f"Stream client {client.name} stopped.")
+        except Exception as e:
+            logger.error(f"Error stopping stream client {client.name}: {e}", exc_info=True)
     logger.info("TG Clients Stopped.")
 
 # --- Web Endpoints ---
 
+def user_ready() -> bool:
+    return gateway is not None or bool(user and user.is_connected)
+
+
+def bot_ready() -> bool:
+    return gateway is not None or bool(bot and bot.is_connected)
+
+
+def posts_available(chat_identifier) -> bool:
+    """Whether posts can be served, the indexed ones are while the userbot is still connecting."""
+    return user_ready() or get_channel_state(chat_identifier) is not None
+
+
+def channel_posts(chat_identifier, page: int = 1, before_id=None, limit: int = PAGE_SIZE):
+    """
+    Yields a page of posts, see bot.iter_posts. In HTTP workers they come from the gateway.
+    """
+    if gateway:
+        return gateway.iter_posts(chat_identifier, page, before_id, limit)
+    return iter_posts(user, chat_identifier, page, before_id, limit)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 @app.get("/")
 async def home_redirect():
     return RedirectResponse(HOME_PAGE_REDIRECT)
@@ -125,54 +249,155 @@ async def home_redirect():
 
 @app.get("/channel/{channel}")
 async def channel_page(channel: str):
-    logger.info(f"Received request for /channel/{channel}")
+    logger.debug(f"Received request for /channel/{channel}")
+    chat_identifier = get_chat_identifier(channel)
     # --- IMPORTANT CHECK ---
-    if not user or not user.is_connected:
+    if not posts_available(chat_identifier):
         logger.error(f"Userbot client NOT connected when /channel/{channel} was accessed. User connected status: {user.is_connected if user else 'None'}")
         raise HTTPException(status_code=503, detail="Userbot client is not connected. Cannot fetch channel history.")
-    
-    logger.info(f"Userbot client IS connected ({user.is_connected}) for /channel/{channel} request.")
 
-    try:
-        if channel.lstrip('-').isdigit():
-            chat_identifier = int(channel)
-        else:
-            chat_identifier = "@" + channel.lstrip('@').lower()
+    return StreamingResponse(render_channel_page(channel, chat_identifier), media_type="text/html")
 
-        posts = await get_posts(user, chat_identifier)
-        phtml = posts_html(posts, channel)
-        return HTMLResponse(
-            HOME_HTML.replace("POSTS", phtml).replace("CHANNEL_ID", channel)
-        )
-    except Exception as e:
-        logger.error(f"Error serving channel page for {channel}: {e}", exc_info=True)
-        return HTMLResponse(f"<h1>Error loading channel: {e}</h1><p>An unexpected error occurred. Check logs for details.</p>", status_code=500)
+
+async def render_channel_page(channel: str, chat_identifier):
+    # the page shell is sent right away, post cards follow as they are indexed
+    for kind, value in HOME_TEMPLATE:
+        if kind == "text":
+            yield value
+        elif value == "CHANNEL_ID":
+            yield channel
+        elif value == "POSTS":
+            posts = []
+            try:
+                async for post in channel_posts(chat_identifier):
+                    posts.append(post)
+                    yield post_html(post, channel)
+            except Exception as e:
+                logger.error(f"Error serving channel page for {channel}: {e}", exc_info=True)
+                yield "<h1>Error loading channel</h1><p>An unexpected error occurred. Check logs for details.</p>"
+            schedule_thumb_prefetch(bot, chat_identifier, posts)
 
 
 @app.get("/api/posts/{channel}/{page}")
 async def get_posts_api(channel: str, page: int = 1):
-    logger.info(f"Received request for /api/posts/{channel}/{page}")
+    logger.debug(f"Received request for /api/posts/{channel}/{page}")
+    chat_identifier = get_chat_identifier(channel)
     # --- IMPORTANT CHECK ---
-    if not user or not user.is_connected:
+    if not posts_available(chat_identifier):
         logger.error(f"Userbot client NOT connected when /api/posts/{channel}/{page} was accessed. User connected status: {user.is_connected if user else 'None'}")
         raise HTTPException(status_code=503, detail="Userbot client is not connected. Cannot fetch channel history.")
 
-    logger.info(f"Userbot client IS connected ({user.is_connected}) for /api/posts/{channel}/{page} request.")
-
     try:
-        if channel.lstrip('-').isdigit():
-            chat_identifier = int(channel)
-        else:
-            chat_identifier = "@" + channel.lstrip('@').lower()
-
-        posts = await get_posts(user, chat_identifier, page)
+        posts = [post async for post in channel_posts(chat_identifier, page)]
+        schedule_thumb_prefetch(bot, chat_identifier, posts)
         phtml = posts_html(posts, channel)
         return {"html": phtml}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching posts API for channel {channel}, page {page}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to fetch posts: {e}. An unexpected error occurred.")
 
 
+def encode_cursor(msg_id: int) -> str:
+    return base64.urlsafe_b64encode(f"m{msg_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if not value.startswith("m"):
+            raise ValueError(cursor)
+        return int(value[1:])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/api/v2/posts/{channel}")
+async def get_posts_v2_api(channel: str, request: Request, cursor: str = "", limit: int = 50):
+    logger.debug(f"Received request for /api/v2/posts/{channel}")
+    before_id = decode_cursor(cursor) if cursor else None
+    limit = max(1, min(limit, 200))
+    chat_identifier = get_chat_identifier(channel)
+    # --- IMPORTANT CHECK ---
+    if not posts_available(chat_identifier):
+        logger.error(f"Userbot client NOT connected when /api/v2/posts/{channel} was accessed.")
+        raise HTTPException(status_code=503, detail="Userbot client is not connected. Cannot fetch channel history.")
+
+    try:
+        posts = [post async for post in channel_posts(chat_identifier, before_id=before_id, limit=limit)]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching posts API v2 for channel {channel}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to fetch posts: {e}. An unexpected error occurred.")
+    schedule_thumb_prefetch(bot, chat_identifier, posts)
+
+    body = json.dumps(
+        {
+            "posts": [
+                {
+                    "id": post["msg-id"],
+                    "title": post["title"],
+                    "size": post["size"],
+                    "mime": post["mime"],
+                    "duration": post["duration"],
+                    "thumb": post["thumb"],
+                }
+                for post in posts
+            ],
+            "next_cursor": encode_cursor(posts[-1]["msg-id"]) if len(posts) == limit else None,
+        },
+        separators=(",", ":"),
+    ).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/search/{channel}")
+async def search_api(channel: str, q: str = "", limit: int = 50):
+    # Served from the local full text index, never calls Telegram
+    logger.debug(f"Received request for /api/search/{channel}")
+    try:
+        posts = search_posts(get_chat_identifier(channel), q, max(1, min(limit, 200)))
+        return {"posts": posts, "html": posts_html(posts, channel)}
+    except Exception as e:
+        logger.error(f"Error searching posts for channel {channel}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to search posts: {e}. An unexpected error occurred.")
+
+
+@app.get("/healthz")
+async def healthz():
+    # liveness only, the clients may still be connecting
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if gateway:
+        status_code, body = await gateway.ready()
+        return JSONResponse(body, status_code=status_code)
+    clients = {
+        "user": bool(user and user.is_connected),
+        "bot": bool(bot and bot.is_connected),
+        **{client.name: client.is_connected for client in stream_clients},
+    }
+    ready = clients["user"] and clients["bot"]
+    return JSONResponse({"ready": ready, "clients": clients}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    content = REGISTRY.render()
+    if gateway:
+        # a worker only sees its own requests, the gateway adds the Telegram calls of every worker
+        content = merge_metrics(content, await gateway.metrics())
+    return Response(content=content, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/static/{file}")
 async def static_files(file: str):
     file_path = f"static/{file}"
@@ -183,43 +408,128 @@ async def static_files(file: str):
         raise HTTPException(status_code=404, detail="Static file not found")
 
 
-@app.get("/api/thumb/{channel}/{id}")
-async def get_thumb_endpoint(channel: str, message_id: int):
-    # --- IMPORTANT CHECK ---
-    if not bot or not bot.is_connected:
-        logger.error(f"Bot client NOT connected when /api/thumb/{channel}/{id} was accessed.")
-        raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot get thumbnails.")
-    logger.info(f"Bot client IS connected ({bot.is_connected}) for /api/thumb/{channel}/{id} request.")
+THUMB_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
-    try:
-        img_path = await get_image(bot, message_id, channel)
-        if img_path and os.path.exists(img_path):
-            return FileResponse(img_path, media_type="image/jpeg")
-        else:
-            logger.warning(f"Image not found for channel {channel}, ID {message_id}")
-            raise HTTPException(status_code=404, detail="Image not found or could not be downloaded.")
-    except Exception as e:
-        logger.error(f"Error getting thumbnail for channel {channel}, ID {message_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to get thumbnail: {e}")
+
+@app.get("/api/thumb/{channel}/{message_id}")
+async def get_thumb_endpoint(channel: str, message_id: int, request: Request):
+    chat_identifier = get_chat_identifier(channel)
+    thumb = get_cached_thumb(chat_identifier, message_id)
+
+    if thumb is None:
+        # --- IMPORTANT CHECK ---
+        if not bot_ready() and not has_cached_thumb(chat_identifier, message_id):
+            logger.error(f"Bot client NOT connected when /api/thumb/{channel}/{message_id} was accessed.")
+            raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot get thumbnails.")
+        try:
+            if gateway:
+                thumb = await gateway.get_thumb(chat_identifier, message_id)
+            else:
+                thumb = await get_thumb_bytes(bot, message_id, chat_identifier)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting thumbnail for channel {channel}, ID {message_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Failed to get thumbnail: {e}")
+
+    if thumb is None:
+        logger.warning(f"Image not found for channel {channel}, ID {message_id}")
+        raise HTTPException(status_code=404, detail="Image not found or could not be downloaded.")
+
+    data, etag = thumb
+    headers = {"ETag": etag, "Cache-Control": THUMB_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 
 # --- Streamer Endpoints ---
-@app.get("/stream/{channel}/{id}")
+@app.get("/stream/{channel}/{message_id}")
 async def stream_page(channel: str, message_id: int):
     return HTMLResponse(
         STREAM_HTML.replace("URL", f"{BASE_URL}/api/stream/{channel}/{message_id}")
     )
 
 
-@app.get("/api/stream/{channel}/{id}")
+@app.api_route("/api/stream/{channel}/{message_id}", methods=["GET", "HEAD"])
 async def stream_api(channel: str, message_id: int, request: Request):
     # --- IMPORTANT CHECK ---
+    if not bot_ready():
+        logger.error(f"Bot client NOT connected when /api/stream/{channel}/{message_id} was accessed.")
+        raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot stream media.")
+    logger.debug(f"Bot client IS connected for /api/stream/{channel}/{message_id} request.")
+
+    return await media_streamer(bot, get_chat_identifier(channel), message_id, request)
+
+
+# --- Gateway Endpoints ---
+# Only served by the gateway process, on its Unix socket, for the HTTP workers
+internal = APIRouter(prefix="/internal")
+
+
+@internal.get("/posts/{channel}")
+async def internal_posts(channel: str, page: int = 1, before_id: int = None, limit: int = PAGE_SIZE):
+    chat_identifier = get_chat_identifier(channel)
+    if not posts_available(chat_identifier):
+        raise HTTPException(status_code=503, detail="Userbot client is not connected. Cannot fetch channel history.")
+
+    async def lines():
+        # one JSON post per line, sent as soon as it is indexed
+        posts = []
+        try:
+            async for post in iter_posts(user, chat_identifier, page, before_id, limit):
+                posts.append(post)
+                yield json.dumps(post) + "\n"
+        except Exception as e:
+            logger.error(f"Error fetching posts for a worker, channel {channel}: {e}", exc_info=True)
+        schedule_thumb_prefetch(bot, chat_identifier, posts)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@internal.get("/thumb/{channel}/{message_id}")
+async def internal_thumb(channel: str, message_id: int):
+    chat_identifier = get_chat_identifier(channel)
+    if not bot_ready() and not has_cached_thumb(chat_identifier, message_id):
+        raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot get thumbnails.")
+    thumb = await get_thumb_bytes(bot, message_id, chat_identifier)
+    if thumb is None:
+        raise HTTPException(status_code=404, detail="Image not found or could not be downloaded.")
+    data, etag = thumb
+    return Response(content=data, media_type="image/jpeg", headers={"ETag": etag})
+
+
+@internal.get("/file/{channel}/{message_id}")
+async def internal_file(channel: str, message_id: int, stream: str):
     if not bot or not bot.is_connected:
-        logger.error(f"Bot client NOT connected when /api/stream/{channel}/{id} was accessed.")
         raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot stream media.")
-    logger.info(f"Bot client IS connected ({bot.is_connected}) for /api/stream/{channel}/{id} request.")
+    # resolved with the client that will serve the stream's parts, file ids are per bot
+    tg_connect = get_byte_streamer(remote_stream_client(stream, bot))
+    file_id = await tg_connect.get_file_properties(get_chat_identifier(channel), message_id)
+    return {
+        "file_id": file_id.encode(),
+        "file_size": file_id.file_size,
+        "mime_type": file_id.mime_type,
+        "file_name": file_id.file_name,
+        "unique_id": file_id.unique_id,
+    }
+
+
+@internal.get("/part/{channel}/{message_id}")
+async def internal_part(channel: str, message_id: int, offset: int, limit: int, stream: str):
+    if not bot or not bot.is_connected:
+        raise HTTPException(status_code=503, detail="Bot client is not connected. Cannot stream media.")
+    # file ids are per bot, the part is fetched with the stream's own client and its cached file id
+    tg_connect = get_byte_streamer(remote_stream_client(stream, bot))
+    file_id = await tg_connect.get_file_properties(get_chat_identifier(channel), message_id)
+    chunk = await tg_connect.get_part(file_id, offset, limit)
+    if not chunk:
+        raise HTTPException(status_code=502, detail="Failed to get the part from Telegram.")
+    return Response(content=chunk, media_type="application/octet-stream")
+
 
-    return await media_streamer(bot, channel, message_id, request)
+if ROLE == "gateway":
+    app.include_router(internal)
 
 
 # --- Bot Commands (handled by Pyrogram client) ---
@@ -228,7 +538,7 @@ async def stream_api(channel: str, message_id: int, request: Request):
 async def start_cmd(_, msg: Message):
     logger.info(f"Received /start from {msg.from_user.id}")
     await msg.reply_text(
-        "TechZIndex Up and Running\n\n/clean_cache to clean website cache\n/help to know how to use this bot\n\nMade By @TechZBots | @TechZBots_Support"
+        "TechZIndex Up and Running\n\n/clean_cache to clean website cache\n/recrawl to index a channel again\n/help to know how to use this bot\n\nMade By @TechZBots | @TechZBots_Support"
     )
 
 @bot.on_message(filters.command("help"))
@@ -253,7 +563,14 @@ async def clean_cache_cmd(_, msg: Message):
     logger.info(f"Received /clean_cache from {msg.from_user.id}")
     if msg.from_user.id in ADMINS:
         x = msg.text.split(" ")
-        if len(x) == 2:
+        if len(x) == 3 and x[2] == "refresh" and crawler:
+            # keeps serving the cached posts while the channel is crawled again
+            channel = get_chat_identifier(x[1])
+            rm_cache(channel, keep_posts=True)
+            crawler.enqueue(channel, recrawl=True)
+            await msg.reply_text(f"Refreshing {channel} in the background")
+            return
+        if len(x) >= 2:
             rm_cache(x[1])
         else:
             rm_cache()
@@ -262,3 +579,28 @@ async def clean_cache_cmd(_, msg: Message):
         await msg.reply_text(
             f"You are not my owner\n\nContact [Owner](tg://user?id={OWNER_ID}) If You Want To Update Your Site\n\nRead : https://t.me/TechZBots/524"
         )
+
+@bot.on_message(filters.channel)
+async def channel_post_handler(_, msg: Message):
+    # keeps indexed channels up to date without refetching their history
+    if msg.chat.username:
+        index_message("@" + msg.chat.username.lower(), msg)
+    index_message(msg.chat.id, msg)
+
+
+@bot.on_message(filters.command("recrawl"))
+async def recrawl_cmd(_, msg: Message):
+    logger.info(f"Received /recrawl from {msg.from_user.id}")
+    if msg.from_user.id not in ADMINS:
+        await msg.reply_text(
+            f"You are not my owner\n\nContact [Owner](tg://user?id={OWNER_ID}) If You Want To Update Your Site"
+        )
+        return
+    if not crawler:
+        await msg.reply_text("Crawler is not running")
+        return
+    x = msg.text.split(" ")
+    channels = [x[1]] if len(x) == 2 else CRAWL_CHANNELS
+    for channel in channels:
+        crawler.enqueue(get_chat_identifier(channel), recrawl=True)
+    await msg.reply_text(f"Re-crawl queued for {len(channels)} channel(s)")